@@ -1,10 +1,11 @@
 from flask import Flask, request, redirect, jsonify, Response, render_template
 from util import spotify, firestore
+from util.token_cache import make_token_cache
 import os, time, base64, random, json
 
 app = Flask(__name__)
 db = firestore.get_firestore_db()
-CACHE_TOKEN_INFO = {}
+TOKEN_CACHE = make_token_cache()
 
 # === AUTH ===
 @app.route("/api/login")
@@ -39,6 +40,7 @@ def callback():
         "refresh_token": token_info.get("refresh_token"),
         "expired_ts": expired_ts,
     })
+    TOKEN_CACHE.set(uid, {"access_token": token_info["access_token"], "expired_ts": expired_ts})
 
     return f"""
         <html>
@@ -2,6 +2,7 @@ from flask import Flask, Response, render_template, request
 from dotenv import load_dotenv, find_dotenv
 from util.firestore import get_firestore_db
 from util import spotify
+from util.token_cache import make_token_cache
 from time import time
 
 load_dotenv(find_dotenv())
@@ -9,6 +10,7 @@ load_dotenv(find_dotenv())
 print("Starting Callback Server")
 
 db = get_firestore_db()
+TOKEN_CACHE = make_token_cache()
 app = Flask(__name__)
 
 
@@ -49,6 +51,8 @@ def catch_all(path):
         # Save to Firestore
         doc_ref = db.collection("users").document(user_id)
         doc_ref.set(token_info)
+        # Warm the shared token cache so the first card skips Firestore
+        TOKEN_CACHE.set(user_id, token_info)
 
         rendered_data = {
             "uid": user_id,
@@ -1,17 +1,37 @@
-from flask import Flask, Response, render_template, request
+from flask import Flask, Response, request
 from base64 import b64encode
 from dotenv import load_dotenv, find_dotenv
 from util.firestore import get_firestore_db
 from util.profanity import profanity_check
+from util.singleflight import SingleFlight
+from util.cache import LRUCache, TTLCache
+from util.diskstore import DiskStore
+from util.palette import extract_palette
+from util.cover import encode_cover, decode_cover, select_image_variant
+from util.theme import ThemeRenderer
+from util.token_cache import make_token_cache
+from util.refresher import TokenRefresher, SKIPPED as REFRESH_SKIPPED
+from util.poller import HotSetPoller
+from util.lease import FirestoreLease
+from util.bloom import AgingBloomFilter
+from util.compress import compress_svg, pick_encoding
+from util import metrics
+from util.metrics import timed
 from PIL import Image, ImageFile
-from time import time
-import io
+from google.api_core.exceptions import NotFound
+from time import perf_counter, sleep, time
 from util import spotify
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import os
 import random
+import threading
 import requests
-import functools
-import colorgram
 import html
+import json
+import hashlib
+import hmac
+import math
 
 load_dotenv(find_dotenv())
 
@@ -20,37 +40,207 @@ ImageFile.LOAD_TRUNCATED_IMAGES = True
 print("Starting Server")
 
 db = get_firestore_db()
-CACHE_TOKEN_INFO = {}
-# Add response cache with timestamp
-CACHE_SVG_RESPONSE = {}
+TOKEN_CACHE = make_token_cache()
+# Rendered SVG responses, bounded by their total size (cards with an embedded
+# cover are 30-60 KB each). Cards stay fresh as long as the playback state
+# they were rendered from; SVG_CACHE_TTL is for cards without one.
+SVG_CACHE_TTL = int(os.getenv("SVG_CACHE_TTL", "30"))
+
+# Playback state freshness: until the playing track ends (clamped to
+# TRACK_TTL_MIN..TRACK_TTL_MAX), or OFFLINE_TTL when nothing is playing
+# (error cards keep SVG_CACHE_TTL)
+TRACK_TTL_MIN = int(os.getenv("TRACK_TTL_MIN", "10"))
+TRACK_TTL_MAX = int(os.getenv("TRACK_TTL_MAX", "180"))
+OFFLINE_TTL = int(os.getenv("OFFLINE_TTL", "300"))
+SVG_CACHE_BYTES = int(os.getenv("SVG_CACHE_BYTES", str(128 * 1024 * 1024)))
+# Stale-while-revalidate: past its TTL a card is still served for up to
+# SVG_MAX_STALE seconds while a background task rebuilds it; at most
+# REVALIDATE_CONCURRENCY cards are rebuilt in the background at once
+SVG_MAX_STALE = int(os.getenv("SVG_MAX_STALE", "300"))
+SVG_CACHE = TTLCache(SVG_CACHE_BYTES, SVG_CACHE_TTL, max_stale=SVG_MAX_STALE)
+REVALIDATE_CONCURRENCY = int(os.getenv("REVALIDATE_CONCURRENCY", "16"))
+
+# Playback state per uid (get_song_info result plus its processed covers by
+# size) that every theme / colour variant of the uid's card is rendered from,
+# so Spotify is called once per user rather than once per variant
+PLAYBACK_STATE_BYTES = int(os.getenv("PLAYBACK_STATE_BYTES", str(32 * 1024 * 1024)))
+# Stale state is only used while Spotify is rate limiting us
+PLAYBACK_STATE = TTLCache(PLAYBACK_STATE_BYTES, SVG_CACHE_TTL, max_stale=SVG_MAX_STALE)
+
+# Processed cover artifacts (base64 image + palette) keyed by (url, size),
+# bounded by the total size of the encoded images
+COVER_SIZE = 200
+# CSS pixel size each theme displays the cover at; covers are produced at
+# this size times COVER_SCALE (2 for hi-DPI screens)
+THEME_COVER_SIZES = {
+    "default": 300,
+    "compact": 300,
+    "karaoke": 300,
+    "apple": 288,
+    "spotify-embed": 120,
+    "novatorem": 80,
+    "natemoo-re": 64,
+}
+COVER_SCALE = float(os.getenv("COVER_SCALE", "1"))
+
+# Bar visualizer: bars are BAR_STEP px apart; "compact" CSS replaces the
+# per-bar nth-child rules with a flex layout and shared animation groups
+NUM_BARS = 75
+BAR_STEP = 4
+BAR_ANIMATION_GROUPS = 7
+BAR_CSS = os.getenv("BAR_CSS", "full").lower()
+THEME_BAR_WIDTHS = {
+    "novatorem": 2,
+}
+# png | jpeg | webp, and the encoded size lossy formats aim to stay under
+COVER_FORMAT = os.getenv("COVER_FORMAT", "jpeg").lower()
+COVER_MAX_BYTES = int(os.getenv("COVER_MAX_BYTES", "12000"))
+COVER_CACHE_BYTES = int(os.getenv("COVER_CACHE_BYTES", str(64 * 1024 * 1024)))
+COVER_CACHE = LRUCache(COVER_CACHE_BYTES)
+
+# Cover decode plus palette extraction; past this the palette is skipped (and
+# the default bar colour used)
+PALETTE_TIME_BUDGET = float(os.getenv("PALETTE_TIME_BUDGET_MS", "50")) / 1000
+
+# Optional on-disk cover store shared by all workers on the node
+COVER_STORE_DIR = os.getenv("COVER_STORE_DIR")
+COVER_STORE_BYTES = int(os.getenv("COVER_STORE_BYTES", str(512 * 1024 * 1024)))
+COVER_STORE = DiskStore(COVER_STORE_DIR, COVER_STORE_BYTES) if COVER_STORE_DIR else None
+
+# /metrics is off unless METRICS_TOKEN is set; scrapers then send it as
+# "Authorization: Bearer <token>". Vercel routes every path to this app, so
+# it must not be open by default.
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Only one token lookup / SVG build per key runs at a time in this process;
+# concurrent requests for the same key wait for it and share the result
+TOKEN_FLIGHT = SingleFlight()
+SVG_FLIGHT = SingleFlight()
+STATE_FLIGHT = SingleFlight()
+
+# uids with no Firestore document (never connected, or revoked and deleted)
+# are remembered in a Bloom filter for NEGATIVE_CACHE_TTL to twice that many
+# seconds, so abandoned embeds and scrapers do not cost a Firestore read per
+# request. A token cache entry (written by the callback after a new login)
+# takes precedence, but only a shared token cache carries it over from the
+# callback process, so without one the TTL stays as short as a card's.
+NEGATIVE_CACHE_TTL = int(os.getenv(
+    "NEGATIVE_CACHE_TTL", "600" if TOKEN_CACHE.shared else str(SVG_CACHE_TTL)
+))
+NEGATIVE_CACHE_CAPACITY = int(os.getenv("NEGATIVE_CACHE_CAPACITY", "100000"))
+NEGATIVE_CACHE_ERROR_RATE = float(os.getenv("NEGATIVE_CACHE_ERROR_RATE", "0.0001"))
+NEGATIVE_UIDS = AgingBloomFilter(NEGATIVE_CACHE_CAPACITY, NEGATIVE_CACHE_ERROR_RATE, NEGATIVE_CACHE_TTL)
+
+# Refresh tokens of recently viewed uids shortly before they expire, so card
+# requests do not wait on accounts.spotify.com
+PROACTIVE_REFRESH = os.getenv("PROACTIVE_REFRESH", "false").lower() == "true"
+REFRESH_LEAD_SECONDS = int(os.getenv("REFRESH_LEAD_SECONDS", "300"))
+REFRESH_JITTER_SECONDS = int(os.getenv("REFRESH_JITTER_SECONDS", "120"))
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "4"))
+
+# Only the worker holding a uid's lease (on its users document) calls
+# accounts.spotify.com; others poll Firestore for the new token for up to
+# REFRESH_LEASE_WAIT seconds before refreshing anyway
+REFRESH_LEASE_SECONDS = int(os.getenv("REFRESH_LEASE_SECONDS", "10"))
+REFRESH_LEASE_WAIT = float(os.getenv("REFRESH_LEASE_WAIT", "3"))
+REFRESH_LEASE_POLL = 0.2
+REFRESH_LEASE = FirestoreLease(db, ttl=REFRESH_LEASE_SECONDS)
+
+# Hot set poller: re-fetch the most viewed uids and re-render their most
+# requested variants shortly before the cached cards expire, so popular
+# READMEs are served from cache. Each worker polls up to HOT_SET_BUDGET uids
+# per cycle.
+HOT_SET_POLLER = os.getenv("HOT_SET_POLLER", "false").lower() == "true"
+HOT_SET_INTERVAL = float(os.getenv("HOT_SET_INTERVAL", str(max(1, SVG_CACHE_TTL - 5))))
+HOT_SET_BUDGET = int(os.getenv("HOT_SET_BUDGET", "50"))
+HOT_SET_CONCURRENCY = int(os.getenv("HOT_SET_CONCURRENCY", "4"))
+HOT_SET_VARIANTS = int(os.getenv("HOT_SET_VARIANTS", "3"))
+
+# Speculative fetch of recently-played alongside now-playing:
+#   off      - only fetch recently-played after now-playing says nothing is on
+#   parallel - always fetch both concurrently
+#   adaptive - fetch both concurrently only for uids last seen offline
+SPECULATIVE_FETCH = os.getenv("SPECULATIVE_FETCH", "off").lower()
+SPECULATIVE_FETCH_WORKERS = int(os.getenv("SPECULATIVE_FETCH_WORKERS", "8"))
+FETCH_EXECUTOR = ThreadPoolExecutor(SPECULATIVE_FETCH_WORKERS, thread_name_prefix="spotify-fetch")
+REVALIDATE_EXECUTOR = ThreadPoolExecutor(REVALIDATE_CONCURRENCY, thread_name_prefix="svg-revalidate")
+REVALIDATING = set()
+REVALIDATE_LOCK = threading.Lock()
+# uid -> was playing on the last fetch, oldest first
+LAST_PLAYING_STATE = OrderedDict()
+LAST_PLAYING_STATE_SIZE = 10000
+LAST_PLAYING_STATE_LOCK = threading.Lock()
 
 app = Flask(__name__, template_folder='templates')
+THEME_RENDERER = ThemeRenderer(app.jinja_env)
 
 # === UTILS ===
 
 def isLightOrDark(rgb, threshold=128):
     return "dark" if (rgb[0] * 0.299 + rgb[1] * 0.587 + rgb[2] * 0.114) < threshold else "light"
 
-@functools.lru_cache(maxsize=128)
-def generate_css_bar(num_bar=75):
+def generate_css_bar(num_bar=75, seed="bar"):
+    # Seeded so every worker and restart produces byte-identical cards
+    rng = random.Random(f"{seed}:{num_bar}")
     css_bar = ""
     left = 1
     for i in range(1, num_bar + 1):
-        anim = random.randint(350, 500)
+        anim = rng.randint(350, 500)
         css_bar += (
             ".bar:nth-child({})  {{ left: {}px; animation-duration: {}ms; }}".format(
                 i, left, anim
             )
         )
-        left += 4
+        left += BAR_STEP
     return css_bar
 
-@functools.lru_cache(maxsize=128)
+def generate_compact_css_bar(num_bar=75, seed="bar", bar_width=3):
+    """
+    Same bars as generate_css_bar from a handful of rules: the bars are laid
+    out by flexbox instead of per-bar left offsets, and share
+    BAR_ANIMATION_GROUPS animation durations through nth-child(Kn+j).
+    """
+    rng = random.Random(f"{seed}:{num_bar}")
+    groups = min(BAR_ANIMATION_GROUPS, num_bar)
+    css_bar = (
+        "#bars {{ display: flex; align-items: flex-end; gap: {}px; padding: 0 0 1px 1px; box-sizing: border-box; }}"
+        ".bar {{ position: static; flex: none; }}".format(BAR_STEP - bar_width)
+    )
+    for j in range(1, groups + 1):
+        css_bar += ".bar:nth-child({}n+{}) {{ animation-duration: {}ms; }}".format(
+            groups, j, rng.randint(350, 500)
+        )
+    return css_bar
+
+def _precompute_bars():
+    bars = {}
+    for theme in THEME_COVER_SIZES:
+        if BAR_CSS == "compact":
+            css_bar = generate_compact_css_bar(NUM_BARS, theme, THEME_BAR_WIDTHS.get(theme, 3))
+        else:
+            css_bar = generate_css_bar(NUM_BARS, theme)
+        bars[theme] = css_bar
+    return bars
+
+CONTENT_BAR = "<div class='bar'></div>" * NUM_BARS
+CSS_BARS = _precompute_bars()
+
+def _render_version():
+    """Digest of the templates and settings that shape card bytes, for ETags."""
+    digest = hashlib.sha1()
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(template_dir)):
+        with open(os.path.join(template_dir, name), "rb") as f:
+            digest.update(f.read())
+    settings = (COVER_SIZE, THEME_COVER_SIZES, COVER_SCALE, COVER_FORMAT, COVER_MAX_BYTES, CSS_BARS)
+    digest.update(repr(settings).encode())
+    return digest.hexdigest()[:12]
+
+RENDER_VERSION = _render_version()
+
 def load_image(url):
     try:
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.content
+        return spotify.get_image(url)
     except requests.exceptions.RequestException as e:
         print(f"Error loading image from {url}: {e}")
         return None
@@ -68,299 +258,723 @@ def make_svg(
     mode,
     progress_ms,
     duration_ms,
+    img_mime="image/png",
 ):
     height = 470 if cover_image else 145
 
     if is_now_playing:
         title_text = "Now playing"
-        content_bar = "".join(["<div class='bar'></div>" for _ in range(75)])
+        content_bar = CONTENT_BAR
     elif show_offline:
         title_text = "Not playing"
         content_bar = ""
     else:
         title_text = "Recently played"
-        content_bar = "".join(["<div class='bar'></div>" for _ in range(75)])
+        content_bar = CONTENT_BAR
 
-    css_bar = generate_css_bar(75)
+    css_bar = CSS_BARS.get(theme) or generate_css_bar(NUM_BARS, theme)
 
-    rendered_data = {
+    layout = {
         "height": height,
-        "artist_name": html.escape(artist_name),
-        "song_name": html.escape(song_name),
-        "img": img_b64,
         "cover_image": bool(cover_image),
         "is_now_playing": is_now_playing,
-        "bar_color": bar_color,
         "background_color": background_color,
         "content_bar": content_bar,
         "css_bar": css_bar,
         "title_text": title_text,
     }
+    song_name = html.escape(song_name)
+    dynamic = {
+        "artist_name": html.escape(artist_name),
+        "song_name": song_name,
+        "img": img_b64,
+        "img_mime": img_mime,
+        "bar_color": bar_color,
+        # Made-up duration shown by themes without real progress data
+        "placeholder_duration": f"{len(song_name) // 10}:{(len(song_name) % 10) * 6}",
+    }
 
-    svg_output = render_template(f"spotify.{theme}.html.j2", **rendered_data)
+    svg_output = THEME_RENDERER.render(f"spotify.{theme}.html.j2", layout, dynamic)
     return svg_output
 
 # === API LOGIC ===
 
 def get_access_token(uid):
-    # 1. Check in-memory cache
-    if uid in CACHE_TOKEN_INFO and CACHE_TOKEN_INFO[uid]["expired_ts"] > time():
-        return CACHE_TOKEN_INFO[uid]["access_token"]
-    
-    # 2. Check Firestore
+    # 1. Check the token cache (shared between workers unless memory://)
+    with timed("token_cache"):
+        token_info = TOKEN_CACHE.get(uid)
+    if token_info and token_info["expired_ts"] > time():
+        return token_info["access_token"]
+
+    # 2. Known to have no token
+    if token_info is None and uid in NEGATIVE_UIDS:
+        return None
+
+    return TOKEN_FLIGHT.do(uid, load_access_token, uid)
+
+def load_access_token(uid):
+    # 3. Check Firestore
     doc_ref = db.collection("users").document(uid)
-    doc = doc_ref.get()
+    with timed("firestore"):
+        doc = doc_ref.get()
     if not doc.exists:
+        NEGATIVE_UIDS.add(uid)
         return None
 
     token_info = doc.to_dict()
     
-    # 3. Check if current token is valid
+    # 4. Check if current token is valid
     if token_info["expired_ts"] > time():
-        CACHE_TOKEN_INFO[uid] = token_info
+        TOKEN_CACHE.set(uid, token_info)
         return token_info["access_token"]
         
-    # 4. Refresh token
+    # 5. Refresh token
+    return refresh_access_token(uid, doc_ref, token_info)
+
+def refresh_access_token(uid, doc_ref, token_info, wait=True):
+    if not token_info.get("refresh_token"):
+        raise spotify.InvalidTokenError
+
+    # Someone refreshed since token_info was read: nothing left to do
+    def refreshed(stored):
+        return stored.get("expired_ts", 0) > token_info["expired_ts"]
+
+    try:
+        leased, stored = REFRESH_LEASE.acquire(doc_ref, skip_if=refreshed)
+    except Exception as e:
+        # Firestore errors or transaction retries exhausted; refresh without the lease
+        print(f"Error taking refresh lease for {uid}: {e}")
+        leased, stored = False, None
+    else:
+        if stored is None:
+            raise spotify.InvalidTokenError
+        if refreshed(stored):
+            TOKEN_CACHE.set(uid, stored)
+            return stored["access_token"]
+        # Read inside the transaction, so e.g. a re-login's refresh token is used
+        token_info = stored
+
+        if not leased:
+            # Someone else is refreshing; the background refresher just moves on
+            if not wait:
+                return None
+            access_token = wait_for_refreshed_token(uid, doc_ref)
+            if access_token:
+                return access_token
+            print(f"Refresh lease for {uid} not released in time, refreshing anyway")
+
     refresh_token = token_info.get("refresh_token")
     if not refresh_token:
+        if leased:
+            REFRESH_LEASE.release(doc_ref)
         raise spotify.InvalidTokenError
-        
-    new_token_info = spotify.refresh_token(refresh_token)
-    
+
+    try:
+        new_token_info = spotify.refresh_token(refresh_token)
+    except Exception:
+        if leased:
+            REFRESH_LEASE.release(doc_ref)
+        raise
+
     if "error" in new_token_info:
         if new_token_info["error"] == "invalid_grant":
             doc_ref.delete()
+            TOKEN_CACHE.delete(uid)
+            NEGATIVE_UIDS.add(uid)
+        elif leased:
+            REFRESH_LEASE.release(doc_ref)
         raise spotify.InvalidTokenError
 
-    # Update token in Firestore and cache
-    expired_ts = int(time()) + new_token_info["expires_in"]
-    token_info["access_token"] = new_token_info["access_token"]
-    token_info["expired_ts"] = expired_ts
-    
-    doc_ref.set(token_info)
-    CACHE_TOKEN_INFO[uid] = token_info
-    
-    return token_info["access_token"]
+    # Only the token fields are written, so newer fields are kept and a
+    # document deleted in the meantime is not recreated
+    fields = {
+        "access_token": new_token_info["access_token"],
+        "expired_ts": int(time()) + new_token_info["expires_in"],
+    }
+    try:
+        doc_ref.update(REFRESH_LEASE.releasing(fields) if leased else fields)
+    except NotFound:
+        TOKEN_CACHE.delete(uid)
+        raise spotify.InvalidTokenError
+    TOKEN_CACHE.set(uid, fields)
+
+    return fields["access_token"]
+
+def wait_for_refreshed_token(uid, doc_ref):
+    """Poll Firestore until the lease holder has stored a fresh token."""
+    deadline = time() + REFRESH_LEASE_WAIT
+    while time() < deadline:
+        sleep(REFRESH_LEASE_POLL)
+        doc = doc_ref.get()
+        if not doc.exists:
+            raise spotify.InvalidTokenError
+        token_info = doc.to_dict()
+        if token_info["expired_ts"] > time():
+            TOKEN_CACHE.set(uid, token_info)
+            return token_info["access_token"]
+    return None
+
+def refresh_ahead(uid):
+    """Background refresh for TOKEN_REFRESHER; False stops tracking the uid,
+    REFRESH_SKIPPED means no refresh was needed or another worker is on it."""
+    if TOKEN_CACHE.get(uid) is None and uid in NEGATIVE_UIDS:
+        return False
+
+    doc_ref = db.collection("users").document(uid)
+    doc = doc_ref.get()
+    if not doc.exists:
+        NEGATIVE_UIDS.add(uid)
+        return False
+
+    token_info = doc.to_dict()
+    # Another worker already refreshed it, just pick up the new token
+    if token_info["expired_ts"] - time() > REFRESH_LEAD_SECONDS + REFRESH_JITTER_SECONDS:
+        TOKEN_CACHE.set(uid, token_info)
+        return REFRESH_SKIPPED
 
-def get_song_info(uid, show_offline=False):
-    # 1. Get Access Token
     try:
-        access_token = get_access_token(uid)
+        access_token = refresh_access_token(uid, doc_ref, token_info, wait=False)
     except spotify.InvalidTokenError:
+        return False
+    # None: another worker holds the lease and is refreshing it
+    return True if access_token else REFRESH_SKIPPED
+
+def token_expiry(uid):
+    token_info = TOKEN_CACHE.get(uid)
+    return token_info["expired_ts"] if token_info else None
+
+TOKEN_REFRESHER = TokenRefresher(
+    refresh_ahead,
+    token_expiry,
+    lead_time=REFRESH_LEAD_SECONDS,
+    jitter=REFRESH_JITTER_SECONDS,
+    max_concurrency=REFRESH_CONCURRENCY,
+) if PROACTIVE_REFRESH else None
+
+
+def song_info_error(error, name):
+    return {
+        "error": error,
+        "is_playing": False,
+        "item": {"name": name, "type": "offline", "album": {"images": []}},
+        "currently_playing_type": "track",
+        "progress_ms": 0,
+        "duration_ms": 1,
+        "is_now_playing": False
+    }
+
+def is_now_playing_response(song_info):
+    return song_info.get("is_playing") is not False and "item" in song_info
+
+def song_info_from_now_playing(song_info):
+    item = song_info["item"]
+    return {
+        "is_playing": song_info.get("is_playing", False),
+        "item": item,
+        "currently_playing_type": song_info["currently_playing_type"],
+        "progress_ms": song_info.get("progress_ms", 0),
+        "duration_ms": item.get("duration_ms", 1),
+        "is_now_playing": True
+    }
+
+def song_info_from_recently_played(recently_played):
+    if not recently_played.get("items"):
         return {
-            "error": "invalid_token",
             "is_playing": False,
-            "item": {"name": "Please reconnect", "type": "offline", "album": {"images": []}},
+            "item": {"name": "No recent tracks", "type": "offline", "album": {"images": []}},
             "currently_playing_type": "track",
             "progress_ms": 0,
             "duration_ms": 1,
             "is_now_playing": False
         }
+
+    item = recently_played["items"][0]["track"]
+    return {
+        "is_playing": False,
+        "item": item,
+        "currently_playing_type": item["type"],
+        "progress_ms": 0,
+        "duration_ms": item.get("duration_ms", 1),
+        "is_now_playing": False
+    }
+
+def should_prefetch_recently_played(uid):
+    if SPECULATIVE_FETCH == "parallel":
+        return True
+    if SPECULATIVE_FETCH == "adaptive":
+        return LAST_PLAYING_STATE.get(uid) is False
+    return False
+
+def remember_playing_state(uid, is_playing):
+    with LAST_PLAYING_STATE_LOCK:
+        LAST_PLAYING_STATE[uid] = is_playing
+        LAST_PLAYING_STATE.move_to_end(uid)
+        if len(LAST_PLAYING_STATE) > LAST_PLAYING_STATE_SIZE:
+            LAST_PLAYING_STATE.popitem(last=False)
+
+def get_song_info(uid, show_offline=False):
+    # 1. Get Access Token
+    try:
+        access_token = get_access_token(uid)
+    except spotify.InvalidTokenError:
+        return song_info_error("invalid_token", "Please reconnect")
     
     if not access_token:
-        return {
-            "error": "no_token",
-            "is_playing": False,
-            "item": {"name": "Not authenticated", "type": "offline", "album": {"images": []}},
-            "currently_playing_type": "track",
-            "progress_ms": 0,
-            "duration_ms": 1,
-            "is_now_playing": False
-        }
+        return song_info_error("no_token", "Not authenticated")
+
+    # 2. Get Currently Playing Track, speculatively fetching the most recent
+    # track at the same time for users who are likely offline
+    recently_played = None
+    if should_prefetch_recently_played(uid):
+        recently_played = FETCH_EXECUTOR.submit(spotify.get_recently_play, access_token)
 
-    # 2. Get Currently Playing Track
-    is_now_playing = True
     song_info = spotify.get_now_playing(access_token)
-    
-    if song_info.get("is_playing") is False or "item" not in song_info:
-        # 3. If not playing, get the most recent track
-        song_info = spotify.get_recently_play(access_token)
-        is_now_playing = False
-        
-        if not song_info.get("items"):
-            return {
-                "is_playing": False,
-                "item": {"name": "No recent tracks", "type": "offline", "album": {"images": []}},
-                "currently_playing_type": "track",
-                "progress_ms": 0,
-                "duration_ms": 1,
-                "is_now_playing": False
-            }
-        
-        song_info = song_info["items"][0]
-        song_info["is_playing"] = False
-        song_info["currently_playing_type"] = song_info["track"]["type"]
-        song_info["item"] = song_info["track"]
-        song_info["progress_ms"] = 0
-        song_info["duration_ms"] = song_info["item"]["duration_ms"]
+    is_playing = is_now_playing_response(song_info)
+    remember_playing_state(uid, is_playing)
+    if is_playing:
+        if recently_played:
+            recently_played.cancel()
+        return song_info_from_now_playing(song_info)
 
-    item = song_info["item"]
-    currently_playing_type = song_info["currently_playing_type"]
-    is_playing = song_info.get("is_playing", False)
-    progress_ms = song_info.get("progress_ms", 0)
-    duration_ms = item.get("duration_ms", 1)
+    # 3. If not playing, get the most recent track
+    if recently_played:
+        return song_info_from_recently_played(recently_played.result())
+    return song_info_from_recently_played(spotify.get_recently_play(access_token))
+
+# === CARD BUILDING ===
 
+def parse_params(args):
     return {
-        "is_playing": is_playing,
-        "item": item,
-        "currently_playing_type": currently_playing_type,
-        "progress_ms": progress_ms,
-        "duration_ms": duration_ms,
-        "is_now_playing": is_now_playing
+        "uid": args.get("uid"),
+        "theme": args.get("theme", "default"),
+        "show_offline": args.get("show_offline", "false").lower() == "true",
+        "interchange": args.get("interchange", "false").lower() == "true",
+        "background_color": args.get("background_color", "0d1117").lower(),
+        "is_skip_dark": args.get("is_skip_dark", "true").lower() == "true",
+        "is_enable_profanity": args.get("is_enable_profanity", "true").lower() == "true",
+        "mode": args.get("mode", "light").lower(),
+    }
+
+def make_cache_key(params):
+    return "{uid}:{theme}:{show_offline}:{interchange}:{background_color}:{is_skip_dark}:{is_enable_profanity}:{mode}".format(**params)
+
+def get_cached_svg(cache_key, current_time):
+    """((svg, etag, encoded, fresh_until), is_fresh) cached for cache_key, or None."""
+    return SVG_CACHE.lookup(cache_key, now=current_time)
+
+def cache_svg(cache_key, svg, etag, current_time, encoded=None, fresh_until=None):
+    """Cache a card with its gzip / brotli encodings, compressed here unless given."""
+    if encoded is None:
+        encoded = compress_svg(svg)
+    if fresh_until is None:
+        fresh_until = current_time + SVG_CACHE_TTL
+    size = len(svg) + sum(len(body) for body in encoded.values())
+    entry = (svg, etag, encoded, fresh_until)
+    SVG_CACHE.put(cache_key, entry, size, ttl=fresh_until - current_time, now=current_time)
+    return entry
+
+def card_fresh_until(state, current_time):
+    """A card is fresh as long as its playback state (but at least TRACK_TTL_MIN,
+    as the state may be a stale one kept while rate limited)."""
+    if state is None:
+        return current_time + SVG_CACHE_TTL
+    return max(state["fresh_until"], current_time + TRACK_TTL_MIN)
+
+def cache_control(fresh_until):
+    """Cache-Control letting shared caches keep the card until it may change."""
+    return f"s-maxage={max(1, math.ceil(fresh_until - time()))}, stale-while-revalidate"
+
+def card_etag(cache_key, song_info, card):
+    """Strong ETag from the track, playing state, render params and template version."""
+    item = (song_info or {}).get("item") or {}
+    parts = (
+        RENDER_VERSION,
+        cache_key,
+        item.get("id"),
+        card["song_name"],
+        card["is_now_playing"],
+        card["bar_color"],
+        bool(card["cover_image"]),
+    )
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+def theme_cover_size(theme):
+    return round(THEME_COVER_SIZES.get(theme, COVER_SIZE) * COVER_SCALE)
+
+def get_cover_url(song_info, size=COVER_SIZE):
+    if "error" in song_info:
+        return None
+    images = song_info["item"].get("album", {}).get("images")
+    image = select_image_variant(images, size)
+    return image["url"] if image else None
+
+def process_cover(cover_image, size=COVER_SIZE):
+    """Resize and encode the cover to base64 and extract its palette."""
+    started = perf_counter()
+    with timed("decode"):
+        img = decode_cover(cover_image, size)
+
+    # Extract colors for bar from the already decoded image, within a budget
+    # that includes the decode
+    try:
+        with timed("palette"):
+            palette = extract_palette(img, 10, time_budget=PALETTE_TIME_BUDGET, started=started)
+    except Exception as e:
+        print(f"Error extracting colors from image: {e!r}")
+        palette = None
+
+    # Resize and convert to Base64
+    with timed("resize"):
+        img = img.resize((size, size), Image.LANCZOS)
+    with timed("encode"):
+        data, mime = encode_cover(img, COVER_FORMAT, COVER_MAX_BYTES)
+
+    return {
+        "img_b64": b64encode(data).decode("ascii"),
+        "img_mime": mime,
+        "palette": palette,
     }
 
+def pick_bar_color(palette, is_skip_dark):
+    for rgb in palette or []:
+        light_or_dark = isLightOrDark(rgb, threshold=80)
+
+        if light_or_dark == "dark" and is_skip_dark:
+            continue
+
+        return "%02x%02x%02x" % tuple(rgb)
+    return "53b14f"
+
+def _cover_key(image_url, size):
+    return f"{image_url}@{size}.{COVER_FORMAT}.{COVER_MAX_BYTES}"
+
+def get_cached_cover(image_url, size=COVER_SIZE, use_store=True):
+    cover = COVER_CACHE.get(_cover_key(image_url, size))
+    if cover is None and use_store and COVER_STORE is not None:
+        cover = get_stored_cover(image_url, size)
+    return cover
+
+def get_stored_cover(image_url, size=COVER_SIZE):
+    """Cover another worker on this node may already have processed, from COVER_STORE."""
+    cover = None
+    try:
+        data = COVER_STORE.get(_cover_key(image_url, size))
+        if data:
+            cover = json.loads(data)
+            _cache_cover_in_memory(image_url, cover, size)
+    except (OSError, ValueError) as e:
+        print(f"Error reading cover store: {e}")
+    return cover
+
+def _cache_cover_in_memory(image_url, cover, size):
+    COVER_CACHE.put(_cover_key(image_url, size), cover, len(cover["img_b64"]) + 32 * len(cover["palette"]))
+
+def cache_cover(image_url, cover, size=COVER_SIZE):
+    # Palette extraction failed or ran out of time, retry on the next miss
+    if cover["palette"] is None:
+        return
+
+    _cache_cover_in_memory(image_url, cover, size)
+    if COVER_STORE is not None:
+        try:
+            COVER_STORE.put(_cover_key(image_url, size), json.dumps(cover).encode("utf-8"))
+        except OSError as e:
+            print(f"Error writing cover store: {e}")
+
+def load_cover(image_url, size=COVER_SIZE):
+    cover = get_cached_cover(image_url, size)
+    if cover is None:
+        cover_image = load_image(image_url)
+        if not cover_image:
+            return None
+        cover = process_cover(cover_image, size)
+        cache_cover(image_url, cover, size)
+    return cover
+
+def get_playback_state(uid):
+    found = PLAYBACK_STATE.lookup(uid)
+    if found is not None and found[1]:
+        return found[0]
+    try:
+        return STATE_FLIGHT.do(uid, load_playback_state, uid)
+    except spotify.RateLimitedError:
+        # Keep rendering the last known state until Spotify lets us back in
+        if found is None:
+            raise
+        return found[0]
+
+def load_playback_state(uid):
+    return cache_playback_state(uid, get_song_info(uid))
+
+def playback_ttl(song_info):
+    """Seconds until the card may change: the rest of the playing track, clamped."""
+    # Error cards must clear soon after the user reconnects
+    if "error" in song_info:
+        return SVG_CACHE_TTL
+    if not song_info.get("is_now_playing"):
+        return OFFLINE_TTL
+    remaining = (song_info.get("duration_ms", 0) - song_info.get("progress_ms", 0)) / 1000
+    # +1 so the next fetch lands after the track has changed
+    return min(max(remaining + 1, TRACK_TTL_MIN), TRACK_TTL_MAX)
+
+def cache_playback_state(uid, song_info):
+    now = time()
+    ttl = playback_ttl(song_info)
+    # Covers are shared with COVER_CACHE, so only the song info is counted
+    state = {"song_info": song_info, "covers": {}, "fresh_until": now + ttl}
+    PLAYBACK_STATE.put(uid, state, len(json.dumps(song_info)), ttl=ttl, now=now)
+    return state
+
+def playback_cover(state, size):
+    """Processed cover for the state's track at `size`, loaded on first use."""
+    cover = state["covers"].get(size)
+    if cover is None:
+        image_url = get_cover_url(state["song_info"], size)
+        if image_url:
+            cover = load_cover(image_url, size)
+        if cover is not None:
+            state["covers"][size] = cover
+    return cover
+
+def prerender_variants(uid, variants):
+    """Fetch uid's playback state now and re-render the given (cache_key, params) variants."""
+    # Cards rendered from a state that outlives the next cycle are still fresh
+    found = PLAYBACK_STATE.lookup(uid)
+    if found is not None and found[0]["fresh_until"] > time() + HOT_SET_INTERVAL:
+        return
+    STATE_FLIGHT.do(uid, load_playback_state, uid)
+    for cache_key, params in variants:
+        build_svg(params, cache_key, time(), keep_stale=True)
+
+def default_card(song_name="Not Playing"):
+    # Default values for the offline state
+    return {
+        "artist_name": "Spotify",
+        "song_name": song_name,
+        "img_b64": b64encode(b"").decode("ascii"),
+        "img_mime": "image/png",
+        "is_now_playing": False,
+        "cover_image": b"",
+        "bar_color": "53b14f",
+        "progress_ms": 0,
+        "duration_ms": 1,
+    }
+
+def build_card(song_info, params, cover=None):
+    """Turn a get_song_info result and its processed cover into card fields."""
+    # Handle errors gracefully
+    if "error" in song_info:
+        return default_card(song_info["item"]["name"])
+
+    card = default_card()
+    item = song_info["item"]
+    currently_playing_type = song_info["currently_playing_type"]
+    card["is_now_playing"] = song_info["is_now_playing"]
+    card["progress_ms"] = song_info["progress_ms"]
+    card["duration_ms"] = song_info["duration_ms"]
+
+    if cover:
+        card["cover_image"] = True
+        card["img_b64"] = cover["img_b64"]
+        card["img_mime"] = cover["img_mime"]
+        card["bar_color"] = pick_bar_color(cover["palette"], params["is_skip_dark"])
+
+    # Find artist_name and song_name
+    artist_name, song_name = card["artist_name"], card["song_name"]
+    if currently_playing_type == "track":
+        artist_name = item["artists"][0]["name"]
+        song_name = item["name"]
+    elif currently_playing_type == "episode":
+        artist_name = item["show"]["publisher"]
+        song_name = item["name"]
+
+    # Handle profanity filtering
+    if params["is_enable_profanity"]:
+        artist_name = profanity_check(artist_name)
+        song_name = profanity_check(song_name)
+
+    if params["interchange"]:
+        artist_name, song_name = song_name, artist_name
+
+    card["artist_name"], card["song_name"] = artist_name, song_name
+    return card
+
+def render_card(card, params):
+    with timed("render"):
+        return make_svg(
+            card["artist_name"],
+            card["song_name"],
+            card["img_b64"],
+            card["is_now_playing"],
+            card["cover_image"],
+            params["theme"],
+            card["bar_color"],
+            params["show_offline"],
+            params["background_color"],
+            params["mode"],
+            card["progress_ms"],
+            card["duration_ms"],
+            card["img_mime"],
+        )
+
+def svg_response(svg, etag=None, encoded=None, fresh_until=None):
+    # Pre-compressed body from the response cache when the client takes it
+    encoding = pick_encoding(request.headers.get("Accept-Encoding", ""), encoded or {})
+    response = Response(
+        encoded[encoding] if encoding else svg,
+        mimetype="image/svg+xml",
+        headers={
+            "Cache-Control": cache_control(fresh_until or time() + SVG_CACHE_TTL),
+        },
+    )
+    if encoded:
+        response.vary.add("Accept-Encoding")
+    if encoding:
+        response.content_encoding = encoding
+    if etag:
+        # Each encoding is a different representation, so it gets its own ETag
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+        # 304 Not Modified when If-None-Match has this ETag
+        response.make_conditional(request)
+    return response
+
+# === BACKGROUND WORK ===
+
+HOT_SET = HotSetPoller(
+    prerender_variants,
+    interval=HOT_SET_INTERVAL,
+    budget=HOT_SET_BUDGET,
+    max_concurrency=HOT_SET_CONCURRENCY,
+    max_variants=HOT_SET_VARIANTS,
+) if HOT_SET_POLLER else None
+
+def track_view(params, cache_key):
+    uid = params["uid"]
+    # Unknown uids (abandoned embeds, scrapers) are not worth polling
+    if not uid or uid in NEGATIVE_UIDS:
+        return
+    if TOKEN_REFRESHER is not None:
+        TOKEN_REFRESHER.touch(uid)
+    if HOT_SET is not None:
+        HOT_SET.touch(uid, cache_key, params)
+
+# === METRICS ===
+
+def metrics_samples():
+    """Counters and gauges read from the caches, flights and governors at scrape time."""
+    caches = {"svg": SVG_CACHE, "playback_state": PLAYBACK_STATE, "cover": COVER_CACHE}
+    for name, cache in caches.items():
+        for key, value in cache.stats().items():
+            if key in ("entries", "bytes"):
+                yield f"spotify_profile_cache_{key}", "gauge", f"Cache {key}.", {"cache": name}, value
+            else:
+                yield f"spotify_profile_cache_{key}_total", "counter", f"Cache {key.replace('_', ' ')}.", {"cache": name}, value
+
+    flights = {"token": TOKEN_FLIGHT, "svg": SVG_FLIGHT, "playback_state": STATE_FLIGHT}
+    for name, flight in flights.items():
+        stats = flight.stats()
+        yield "spotify_profile_flight_calls_total", "counter", "Calls that did the work.", {"flight": name}, stats["calls"]
+        yield "spotify_profile_flight_coalesced_total", "counter", "Calls that waited for another's result.", {"flight": name}, stats["coalesced"]
+
+    breaker = spotify.client.breaker.stats()
+    yield "spotify_profile_breaker_open", "gauge", "1 while the Spotify circuit breaker is open.", {}, int(breaker["state"] == "open")
+    yield "spotify_profile_breaker_opened_total", "counter", "Times the circuit breaker opened.", {}, breaker["opened"]
+    yield "spotify_profile_breaker_rejected_total", "counter", "Calls refused by the open breaker.", {}, breaker["rejected"]
+    if spotify.client.bucket is not None:
+        yield "spotify_profile_throttled_total", "counter", "Calls refused by the token bucket.", {}, spotify.client.bucket.throttled
+    yield "spotify_profile_negative_cache_hits_total", "counter", "Token lookups answered by the negative cache.", {}, NEGATIVE_UIDS.hits
+    lease = REFRESH_LEASE.stats()
+    yield "spotify_profile_refresh_lease_total", "counter", "Refresh lease attempts.", {"result": "acquired"}, lease["acquired"]
+    yield "spotify_profile_refresh_lease_total", "counter", "Refresh lease attempts.", {"result": "contended"}, lease["contended"]
+
+    workers = {"token_refresher": TOKEN_REFRESHER, "hot_set": HOT_SET}
+    for name, worker in workers.items():
+        if worker is None:
+            continue
+        stats = worker.stats()
+        yield "spotify_profile_background_tracked", "gauge", "uids tracked by background workers.", {"worker": name}, stats["tracked"]
+        for result in ("refreshed", "skipped", "polled", "failed"):
+            if result in stats:
+                yield "spotify_profile_background_runs_total", "counter", "Background runs by result.", {"worker": name, "result": result}, stats[result]
+
+def metrics_allowed(authorization):
+    """Whether an Authorization header carries the METRICS_TOKEN bearer token."""
+    expected = f"Bearer {METRICS_TOKEN}".encode()
+    return bool(METRICS_TOKEN) and hmac.compare_digest((authorization or "").encode(), expected)
+
+@app.route("/metrics")
+def metrics_route():
+    if not METRICS_TOKEN:
+        # Disabled: /metrics is just another card path
+        return catch_all("metrics")
+    if not metrics_allowed(request.headers.get("Authorization")):
+        return Response("Forbidden", status=403, mimetype="text/plain")
+    return Response(metrics.render(extra=metrics_samples()), mimetype="text/plain; version=0.0.4")
+
 # === MAIN ROUTE ===
 
 @app.route("/")
 @app.route("/api/view.py")
 @app.route("/<path:path>")
 def catch_all(path=None):
-    # Get parameters
-    uid = request.args.get("uid")
-    theme = request.args.get("theme", "default")
-    show_offline = request.args.get("show_offline", "false").lower() == "true"
-    interchange = request.args.get("interchange", "false").lower() == "true"
-    background_color = request.args.get("background_color", "0d1117").lower()
-    is_skip_dark = request.args.get("is_skip_dark", "true").lower() == "true"
-    is_enable_profanity = request.args.get("is_enable_profanity", "true").lower() == "true"
-    mode = request.args.get("mode", "light").lower()
-    
-    # Create cache key
-    cache_key = f"{uid}:{theme}:{show_offline}:{interchange}:{background_color}:{is_skip_dark}:{is_enable_profanity}:{mode}"
+    with timed("request"):
+        return view_card()
+
+def view_card():
+    params = parse_params(request.args)
+    cache_key = make_cache_key(params)
+    track_view(params, cache_key)
     
-    # Check response cache (30 second TTL)
+    # Check response cache
     current_time = time()
-    if cache_key in CACHE_SVG_RESPONSE:
-        cached_data = CACHE_SVG_RESPONSE[cache_key]
-        if current_time - cached_data["timestamp"] < 30:
-            return Response(
-                cached_data["svg"],
-                mimetype="image/svg+xml",
-                headers={
-                    "Cache-Control": "s-maxage=30, stale-while-revalidate",
-                }
-            )
-    
-    # Set default values for offline state
-    artist_name = "Spotify"
-    song_name = "Not Playing"
-    img_b64 = b64encode(b"").decode("ascii")
-    is_now_playing = False
-    cover_image = b""
-    bar_color = "53b14f"
-    progress_ms = 0
-    duration_ms = 1
-
-    if not uid:
-        pass  # Will render offline card
+    cached = get_cached_svg(cache_key, current_time)
+    if cached is None:
+        entry = SVG_FLIGHT.do(cache_key, build_svg, params, cache_key, current_time)
     else:
+        entry, fresh = cached
+        if not fresh:
+            revalidate_svg(params, cache_key)
+
+    return svg_response(*entry)
+
+def revalidate_svg(params, cache_key):
+    """Rebuild a stale card in the background. False when at the concurrency cap."""
+    with REVALIDATE_LOCK:
+        if cache_key in REVALIDATING:
+            return True
+        if len(REVALIDATING) >= REVALIDATE_CONCURRENCY:
+            return False
+        REVALIDATING.add(cache_key)
+    REVALIDATE_EXECUTOR.submit(_revalidate_svg, params, cache_key)
+    return True
+
+def _revalidate_svg(params, cache_key):
+    try:
+        build_svg(params, cache_key, time(), keep_stale=True)
+    except Exception as e:
+        print(f"Background revalidation failed for {cache_key}: {e}")
+    finally:
+        with REVALIDATE_LOCK:
+            REVALIDATING.discard(cache_key)
+
+def build_svg(params, cache_key, current_time, keep_stale=False):
+    card, song_info, state = default_card(), None, None
+    if params["uid"]:
         try:
-            song_info = get_song_info(uid, show_offline)
-            
-            # Handle errors gracefully
-            if "error" in song_info:
-                error_type = song_info["error"]
-                if error_type == "invalid_token":
-                    artist_name = "Spotify"
-                    song_name = "Please reconnect"
-                elif error_type == "no_token":
-                    artist_name = "Spotify"
-                    song_name = "Not authenticated"
-                is_now_playing = False
-            else:
-                item = song_info["item"]
-                currently_playing_type = song_info["currently_playing_type"]
-                is_now_playing = song_info["is_now_playing"]
-                progress_ms = song_info["progress_ms"]
-                duration_ms = song_info["duration_ms"]
-                
-                # Extract cover image URL and load it
-                image_url = item.get("album", {}).get("images", [{}])[0].get("url")
-                if image_url:
-                    cover_image = load_image(image_url)
-                
-                if cover_image:
-                    # Resize and convert to Base64
-                    img = Image.open(io.BytesIO(cover_image))
-                    img = img.resize((200, 200), Image.LANCZOS)
-                    
-                    buffered = io.BytesIO()
-                    img.save(buffered, format="PNG", optimize=True)
-                    img_b64 = b64encode(buffered.getvalue()).decode("ascii")
-                    
-                    # Extract color for bar
-                    try:
-                        colors = colorgram.extract(io.BytesIO(cover_image), 10)
-                    except Exception as e:
-                        print(f"Error extracting colors from image: {e}")
-                        colors = []
-
-                    for color in colors:
-                        rgb = color.rgb
-                        light_or_dark = isLightOrDark([rgb.r, rgb.g, rgb.b], threshold=80)
-
-                        if light_or_dark == "dark" and is_skip_dark:
-                            continue
-
-                        bar_color = "%02x%02x%02x" % (rgb.r, rgb.g, rgb.b)
-                        break
-
-                # Find artist_name and song_name
-                if currently_playing_type == "track":
-                    artist_name = item["artists"][0]["name"]
-                    song_name = item["name"]
-                elif currently_playing_type == "episode":
-                    artist_name = item["show"]["publisher"]
-                    song_name = item["name"]
-
-                # Handle profanity filtering
-                if is_enable_profanity:
-                    artist_name = profanity_check(artist_name)
-                    song_name = profanity_check(song_name)
-
-                if interchange:
-                    artist_name, song_name = song_name, artist_name
-
+            state = get_playback_state(params["uid"])
+            song_info = state["song_info"]
+            cover = playback_cover(state, theme_cover_size(params["theme"]))
+            card = build_card(song_info, params, cover)
         except Exception as e:
+            # A background rebuild leaves the stale card in place instead
+            if keep_stale:
+                raise
             print(f"Unhandled error: {e}")
-            artist_name = "Spotify"
-            song_name = "Temporarily unavailable"
-            is_now_playing = False
+            card, song_info, state = default_card("Temporarily unavailable"), None, None
 
     # Generate SVG
-    svg = make_svg(
-        artist_name,
-        song_name,
-        img_b64,
-        is_now_playing,
-        cover_image,
-        theme,
-        bar_color,
-        show_offline,
-        background_color,
-        mode,
-        progress_ms,
-        duration_ms,
-    )
+    svg = render_card(card, params)
+    etag = card_etag(cache_key, song_info, card)
     
     # Cache the response
-    CACHE_SVG_RESPONSE[cache_key] = {
-        "svg": svg,
-        "timestamp": current_time
-    }
-    
-    # Clean old cache entries (keep cache size reasonable)
-    if len(CACHE_SVG_RESPONSE) > 100:
-        oldest_keys = sorted(CACHE_SVG_RESPONSE.keys(), 
-                           key=lambda k: CACHE_SVG_RESPONSE[k]["timestamp"])[:20]
-        for key in oldest_keys:
-            del CACHE_SVG_RESPONSE[key]
-
-    resp = Response(
-        svg,
-        mimetype="image/svg+xml",
-        headers={
-            "Cache-Control": "s-maxage=30, stale-while-revalidate",
-        },
-    )
-    return resp
\ No newline at end of file
+    return cache_svg(cache_key, svg, etag, current_time, fresh_until=card_fresh_until(state, current_time))
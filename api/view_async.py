@@ -0,0 +1,258 @@
+"""
+ASGI variant of the view app.
+
+Token lookup, Spotify calls and the cover download are awaited on a large
+I/O thread pool (they go through the same pooled client as the sync app),
+while cover processing and template rendering run on a small CPU pool, so
+one process can hold hundreds of cards waiting on Spotify at once.
+
+    uvicorn api.view_async:app --port 5005
+
+The sync Flask app in view.py keeps working as before. Its card logic is
+split into steps (parse_params, build_card, render_card, ...) that this app
+reuses along with its caches, so both can be served side by side for
+comparison.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, time
+from urllib.parse import parse_qsl
+
+from api import view
+from util import spotify
+from util.singleflight import AsyncSingleFlight
+from util.compress import compress_svg, pick_encoding
+from util import metrics
+
+ASYNC_IO_WORKERS = int(os.getenv("VIEW_ASYNC_IO_WORKERS", "256"))
+ASYNC_CPU_WORKERS = int(os.getenv("VIEW_ASYNC_CPU_WORKERS", str(os.cpu_count() or 1)))
+
+IO_EXECUTOR = ThreadPoolExecutor(ASYNC_IO_WORKERS, thread_name_prefix="view-io")
+CPU_EXECUTOR = ThreadPoolExecutor(ASYNC_CPU_WORKERS, thread_name_prefix="view-cpu")
+
+SVG_FLIGHT = AsyncSingleFlight()
+STATE_FLIGHT = AsyncSingleFlight()
+# cache_key -> background task rebuilding a stale card
+REVALIDATING = {}
+
+# Every waiting request holds a socket, so size the pools to the I/O pool
+spotify.client.pool_maxsize = max(spotify.client.pool_maxsize, ASYNC_IO_WORKERS)
+
+
+async def run_io(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(IO_EXECUTOR, func, *args)
+
+
+async def run_cpu(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(CPU_EXECUTOR, func, *args)
+
+
+def _render(card, params):
+    with view.app.app_context():
+        return view.render_card(card, params)
+
+
+async def get_song_info(uid, show_offline=False):
+    try:
+        access_token = await run_io(view.get_access_token, uid)
+    except spotify.InvalidTokenError:
+        return view.song_info_error("invalid_token", "Please reconnect")
+
+    if not access_token:
+        return view.song_info_error("no_token", "Not authenticated")
+
+    recently_played = None
+    if view.should_prefetch_recently_played(uid):
+        recently_played = asyncio.ensure_future(run_io(spotify.get_recently_play, access_token))
+
+    try:
+        song_info = await run_io(spotify.get_now_playing, access_token)
+    except BaseException:
+        if recently_played:
+            recently_played.cancel()
+        raise
+
+    is_playing = view.is_now_playing_response(song_info)
+    view.remember_playing_state(uid, is_playing)
+    if is_playing:
+        if recently_played:
+            recently_played.cancel()
+        return view.song_info_from_now_playing(song_info)
+
+    if recently_played is None:
+        recently_played = run_io(spotify.get_recently_play, access_token)
+    return view.song_info_from_recently_played(await recently_played)
+
+
+async def load_cover(image_url, size):
+    # Memory hits are answered on the loop; the disk store opens, writes and
+    # evicts files, so it is only touched from the I/O pool
+    cover = view.get_cached_cover(image_url, size, use_store=False)
+    if cover is None and view.COVER_STORE is not None:
+        cover = await run_io(view.get_stored_cover, image_url, size)
+    if cover is None:
+        cover_image = await run_io(view.load_image, image_url)
+        if not cover_image:
+            return None
+        cover = await run_cpu(view.process_cover, cover_image, size)
+        await run_io(view.cache_cover, image_url, cover, size)
+    return cover
+
+
+async def get_playback_state(uid):
+    found = view.PLAYBACK_STATE.lookup(uid)
+    if found is not None and found[1]:
+        return found[0]
+    try:
+        return await STATE_FLIGHT.do(uid, load_playback_state, uid)
+    except spotify.RateLimitedError:
+        if found is None:
+            raise
+        return found[0]
+
+
+async def load_playback_state(uid):
+    return view.cache_playback_state(uid, await get_song_info(uid))
+
+
+async def playback_cover(state, size):
+    cover = state["covers"].get(size)
+    if cover is None:
+        image_url = view.get_cover_url(state["song_info"], size)
+        if image_url:
+            cover = await load_cover(image_url, size)
+        if cover is not None:
+            state["covers"][size] = cover
+    return cover
+
+
+async def render_view(args):
+    params = view.parse_params(args)
+    cache_key = view.make_cache_key(params)
+    view.track_view(params, cache_key)
+
+    current_time = time()
+    cached = view.get_cached_svg(cache_key, current_time)
+    if cached is not None:
+        response, fresh = cached
+        if not fresh:
+            revalidate_svg(params, cache_key)
+        return response
+
+    return await SVG_FLIGHT.do(cache_key, build_svg, params, cache_key, current_time)
+
+
+def revalidate_svg(params, cache_key):
+    """Rebuild a stale card in a background task, up to REVALIDATE_CONCURRENCY at once."""
+    if cache_key in REVALIDATING or len(REVALIDATING) >= view.REVALIDATE_CONCURRENCY:
+        return
+    task = asyncio.create_task(_revalidate_svg(params, cache_key))
+    REVALIDATING[cache_key] = task
+    task.add_done_callback(lambda _: REVALIDATING.pop(cache_key, None))
+
+
+async def _revalidate_svg(params, cache_key):
+    try:
+        await build_svg(params, cache_key, time(), keep_stale=True)
+    except Exception as e:
+        print(f"Background revalidation failed for {cache_key}: {e}")
+
+
+async def build_svg(params, cache_key, current_time, keep_stale=False):
+    card, song_info, state = view.default_card(), None, None
+    if params["uid"]:
+        try:
+            state = await get_playback_state(params["uid"])
+            song_info = state["song_info"]
+            cover = await playback_cover(state, view.theme_cover_size(params["theme"]))
+            card = view.build_card(song_info, params, cover)
+        except Exception as e:
+            if keep_stale:
+                raise
+            print(f"Unhandled error: {e}")
+            card, song_info, state = view.default_card("Temporarily unavailable"), None, None
+
+    svg = await run_cpu(_render, card, params)
+    etag = view.card_etag(cache_key, song_info, card)
+    encoded = await run_cpu(compress_svg, svg)
+    fresh_until = view.card_fresh_until(state, current_time)
+    return view.cache_svg(cache_key, svg, etag, current_time, encoded, fresh_until)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            IO_EXECUTOR.shutdown(wait=False)
+            CPU_EXECUTOR.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _etag_matches(if_none_match, etag):
+    """If-None-Match uses weak comparison, so W/"x" matches "x"."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == f'"{etag}"':
+            return True
+    return False
+
+
+async def _send_response(send, status, body, content_type, headers=(), head=False):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            # A 304 must not claim a length other than the full response's
+            *([] if status == 304 else [(b"content-length", str(len(body)).encode())]),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": b"" if head else body})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+
+    if scope["type"] != "http":
+        return
+
+    if scope["method"] not in ("GET", "HEAD"):
+        return await _send_response(send, 405, b"Method Not Allowed", "text/plain")
+
+    request_headers = dict(scope.get("headers", ()))
+    if scope.get("path") == "/metrics" and view.METRICS_TOKEN:
+        if not view.metrics_allowed(request_headers.get(b"authorization", b"").decode("latin-1")):
+            return await _send_response(send, 403, b"Forbidden", "text/plain")
+        body = metrics.render(extra=view.metrics_samples()).encode()
+        return await _send_response(send, 200, body, "text/plain; version=0.0.4")
+
+    args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+    start = perf_counter()
+    svg, etag, encoded, fresh_until = await render_view(args)
+    metrics.STAGE_SECONDS.observe(perf_counter() - start, "request")
+    encoding = pick_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1"), encoded)
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    headers = [
+        (b"cache-control", view.cache_control(fresh_until).encode()),
+        (b"etag", f'"{etag}"'.encode()),
+        (b"vary", b"Accept-Encoding"),
+    ]
+    if _etag_matches(request_headers.get(b"if-none-match", b"").decode("latin-1"), etag):
+        return await _send_response(send, 304, b"", "image/svg+xml; charset=utf-8", headers, head=True)
+
+    if encoding:
+        body = encoded[encoding]
+        headers.append((b"content-encoding", encoding.encode()))
+    else:
+        body = svg.encode("utf-8")
+    await _send_response(
+        send, 200, body, "image/svg+xml; charset=utf-8", headers,
+        head=scope["method"] == "HEAD",
+    )
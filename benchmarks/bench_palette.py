@@ -0,0 +1,82 @@
+"""
+Compare colorgram on the full cover against util.palette.extract_palette.
+
+    python benchmarks/bench_palette.py [COVER_DIR]
+
+COVER_DIR is a directory of cover images (e.g. downloaded 640px Spotify
+covers). Without it a synthetic corpus of gradient + noise covers is used.
+Reports the mean time per cover for each extractor and how often both pick
+the same bar colour.
+"""
+import io
+import os
+import random
+import sys
+import time
+
+import colorgram
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from util.palette import extract_palette  # noqa: E402
+
+
+def isLightOrDark(rgb, threshold=128):
+    return "dark" if (rgb[0] * 0.299 + rgb[1] * 0.587 + rgb[2] * 0.114) < threshold else "light"
+
+
+def bar_color(palette):
+    for rgb in palette:
+        if isLightOrDark(rgb, threshold=80) == "dark":
+            continue
+        return "%02x%02x%02x" % tuple(rgb)
+    return "53b14f"
+
+
+def synthetic_corpus(count=40, size=640):
+    rng = random.Random(0)
+    for _ in range(count):
+        img = Image.new("RGB", (size, size), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(img)
+        for _ in range(12):
+            x, y = rng.randrange(size), rng.randrange(size)
+            r = rng.randrange(20, size // 2)
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(rng.randrange(256) for _ in range(3)))
+        buffered = io.BytesIO()
+        img.save(buffered, format="JPEG", quality=85)
+        yield buffered.getvalue()
+
+
+def directory_corpus(path):
+    for name in sorted(os.listdir(path)):
+        with open(os.path.join(path, name), "rb") as f:
+            yield f.read()
+
+
+def main():
+    corpus = list(directory_corpus(sys.argv[1]) if len(sys.argv) > 1 else synthetic_corpus())
+
+    colorgram_time = palette_time = 0.0
+    same = 0
+    for data in corpus:
+        started = time.perf_counter()
+        expected = [tuple(c.rgb) for c in colorgram.extract(io.BytesIO(data), 10)]
+        colorgram_time += time.perf_counter() - started
+
+        started = time.perf_counter()
+        actual = extract_palette(Image.open(io.BytesIO(data)), 10)
+        palette_time += time.perf_counter() - started
+
+        same += bar_color(expected) == bar_color(actual)
+
+    n = len(corpus)
+    print(f"covers:                 {n}")
+    print(f"colorgram (full cover): {colorgram_time / n * 1000:8.2f} ms/cover")
+    print(f"extract_palette:        {palette_time / n * 1000:8.2f} ms/cover (incl. decode)")
+    print(f"speedup:                {colorgram_time / palette_time:8.1f}x")
+    print(f"same bar colour:        {same}/{n}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Time per card render for each theme: full Jinja render vs ThemeRenderer.
+
+    python benchmarks/bench_render.py [ITERATIONS]
+
+Both paths get the same layout and a different song on every iteration,
+as on a stream of cache misses.
+"""
+import html
+import os
+import sys
+import time
+
+from jinja2 import Environment, FileSystemLoader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from util.theme import ThemeRenderer  # noqa: E402
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "..", "api", "templates")
+THEMES = ["default", "compact", "karaoke", "natemoo-re", "novatorem", "apple", "spotify-embed"]
+
+
+def contexts(iterations):
+    css_bar = "".join(
+        ".bar:nth-child({})  {{ left: {}px; animation-duration: {}ms; }}".format(i, 1 + 4 * (i - 1), 400)
+        for i in range(1, 76)
+    )
+    layout = {
+        "height": 470,
+        "cover_image": True,
+        "is_now_playing": True,
+        "background_color": "0d1117",
+        "content_bar": "<div class='bar'></div>" * 75,
+        "css_bar": css_bar,
+        "title_text": "Now playing",
+    }
+    img = "A" * 16000
+    for i in range(iterations):
+        song_name = html.escape(f"Song number {i} & friends")
+        yield layout, {
+            "artist_name": html.escape(f"Artist {i}"),
+            "song_name": song_name,
+            "img": img,
+            "img_mime": "image/jpeg",
+            "bar_color": "53b14f",
+            "placeholder_duration": f"{len(song_name) // 10}:{(len(song_name) % 10) * 6}",
+        }
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    env = Environment(loader=FileSystemLoader(TEMPLATE_DIR))
+    renderer = ThemeRenderer(env)
+
+    print(f"{'theme':<15}{'jinja us':>10}{'spliced us':>12}{'speedup':>9}")
+    for theme in THEMES:
+        name = f"spotify.{theme}.html.j2"
+        template = env.get_template(name)
+
+        started = time.perf_counter()
+        for layout, dynamic in contexts(iterations):
+            template.render(**layout, **dynamic)
+        jinja = (time.perf_counter() - started) / iterations
+
+        started = time.perf_counter()
+        for layout, dynamic in contexts(iterations):
+            renderer.render(name, layout, dynamic)
+        spliced = (time.perf_counter() - started) / iterations
+
+        print(f"{theme:<15}{jinja * 1e6:>10.1f}{spliced * 1e6:>12.1f}{jinja / spliced:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
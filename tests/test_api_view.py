@@ -358,36 +358,42 @@ def test_color_parameters(mock_load_image, mock_make_svg, mock_get_song_info, cl
 @patch('api.view.get_song_info')
 @patch('api.view.make_svg')
 @patch('api.view.load_image')
-@patch('PIL.Image.open')
-@patch('api.view.colorgram.extract')
-def test_bar_color_from_cover(mock_extract, mock_pil_open, mock_load_image, mock_make_svg, mock_get_song_info, client):
+@patch('api.view.extract_palette')
+def test_bar_color_from_cover(mock_extract, mock_load_image, mock_make_svg, mock_get_song_info, client):
     """Test extracting bar color from cover image."""
-    # Mock PIL Image
-    mock_image = MagicMock()
-    mock_pil_open.return_value = mock_image
-    
-    # Mock colorgram color extraction
-    mock_color = MagicMock()
-    mock_color.rgb.r = 255
-    mock_color.rgb.g = 100
-    mock_color.rgb.b = 100
-    mock_extract.return_value = [mock_color]
-    
-    mock_item = {
-        "name": "Test Song",
-        "artists": [{"name": "Test Artist"}],
-        "album": {"images": [{"url": "http://example.com/image.jpg"}] * 3},
-        "currently_playing_type": "track"
+    import io
+    from PIL import Image
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    view.COVER_CACHE.clear()
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 64), (255, 100, 100)).save(buffered, format="JPEG")
+    mock_load_image.return_value = buffered.getvalue()
+    mock_extract.return_value = [(255, 100, 100)]
+
+    mock_get_song_info.return_value = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {
+            "id": "bar_color_track",
+            "name": "Test Song",
+            "artists": [{"name": "Test Artist"}],
+            "album": {"images": [{"url": "http://example.com/bar_color.jpg"}]},
+        },
     }
-    mock_get_song_info.return_value = (mock_item, True, None, None)
     mock_make_svg.return_value = '<svg></svg>'
-    mock_load_image.return_value = b'fake_image_data'
-    
-    response = client.get('/?uid=test_user&bar_color_cover=true')
-    
+
+    response = client.get('/?uid=bar_color_user')
+
     assert response.status_code == 200
     mock_extract.assert_called_once()
     mock_make_svg.assert_called_once()
+    args, kwargs = mock_make_svg.call_args
+    assert args[6] == "ff6464"  # bar_color
 
 
 def test_generate_css_bar():
@@ -404,3 +410,707 @@ def test_generate_css_bar():
     css_10 = generate_css_bar(10)
     css_20 = generate_css_bar(20)
     assert len(css_20) > len(css_10)  # More bars should generate more CSS
+
+
+RECENTLY_PLAYED = {"items": [{"track": {
+    "type": "track",
+    "name": "Old Song",
+    "artists": [{"name": "Old Artist"}],
+    "album": {"images": []},
+    "duration_ms": 1000,
+}}]}
+
+
+@pytest.mark.parametrize("mode,last_state,expect_prefetch", [
+    ("off", False, False),
+    ("parallel", None, True),
+    ("parallel", True, True),
+    ("adaptive", None, False),
+    ("adaptive", True, False),
+    ("adaptive", False, True),
+])
+def test_should_prefetch_recently_played(mode, last_state, expect_prefetch):
+    """Test which uids get recently-played fetched alongside now-playing."""
+    from api import view
+
+    view.LAST_PLAYING_STATE.clear()
+    if last_state is not None:
+        view.remember_playing_state("test_user", last_state)
+
+    with patch('api.view.SPECULATIVE_FETCH', mode):
+        assert view.should_prefetch_recently_played("test_user") is expect_prefetch
+
+
+def test_remember_playing_state_is_bounded_under_threads():
+    """Test that concurrent updates at capacity evict the oldest uids without errors."""
+    from concurrent.futures import ThreadPoolExecutor
+    from api import view
+
+    view.LAST_PLAYING_STATE.clear()
+
+    def remember(start):
+        for i in range(start, start + 500):
+            view.remember_playing_state(f"uid-{i}", i % 2 == 0)
+
+    with patch('api.view.LAST_PLAYING_STATE_SIZE', 50), ThreadPoolExecutor(8) as executor:
+        list(executor.map(remember, range(0, 4000, 500)))
+
+    assert len(view.LAST_PLAYING_STATE) == 50
+    # A uid seen again becomes the newest
+    oldest = next(iter(view.LAST_PLAYING_STATE))
+    view.remember_playing_state(oldest, True)
+    assert list(view.LAST_PLAYING_STATE)[-1] == oldest
+    view.LAST_PLAYING_STATE.clear()
+
+
+@patch('api.view.get_access_token', return_value="token")
+@patch('util.spotify.get_recently_play', return_value=RECENTLY_PLAYED)
+@patch('util.spotify.get_now_playing', return_value={"is_playing": False})
+def test_get_song_info_parallel_fetch_offline(mock_now_playing, mock_recently_play, mock_get_access_token):
+    """Test that a speculative recently-played fetch is used when offline."""
+    from api import view
+
+    with patch('api.view.SPECULATIVE_FETCH', 'parallel'):
+        song_info = view.get_song_info("test_user")
+
+    assert song_info["item"]["name"] == "Old Song"
+    assert song_info["is_now_playing"] is False
+    mock_recently_play.assert_called_once_with("token")
+    assert view.LAST_PLAYING_STATE["test_user"] is False
+
+
+@patch('api.view.get_access_token', return_value="token")
+@patch('util.spotify.get_recently_play', return_value=RECENTLY_PLAYED)
+@patch('util.spotify.get_now_playing')
+def test_get_song_info_adaptive_skips_prefetch_when_playing(mock_now_playing, mock_recently_play, mock_get_access_token):
+    """Test that adaptive mode does not prefetch for uids last seen playing."""
+    from api import view
+
+    mock_now_playing.return_value = {
+        "is_playing": True,
+        "currently_playing_type": "track",
+        "item": {"name": "Test Song", "duration_ms": 2000},
+    }
+    view.remember_playing_state("test_user", True)
+
+    with patch('api.view.SPECULATIVE_FETCH', 'adaptive'):
+        song_info = view.get_song_info("test_user")
+
+    assert song_info["is_now_playing"] is True
+    mock_recently_play.assert_not_called()
+
+
+def make_cover_bytes(color=(200, 40, 40)):
+    import io
+    from PIL import Image
+
+    buffered = io.BytesIO()
+    Image.new("RGB", (640, 640), color).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+@patch('api.view.load_image')
+def test_load_cover_caches_processed_artifact(mock_load_image):
+    """Test that a cover is downloaded and processed once per url."""
+    from api import view
+
+    view.COVER_CACHE.clear()
+    mock_load_image.return_value = make_cover_bytes()
+
+    cover = view.load_cover("http://example.com/cover.jpg")
+    again = view.load_cover("http://example.com/cover.jpg")
+
+    assert again is cover
+    assert cover["img_b64"]
+    assert view.pick_bar_color(cover["palette"], True) != "53b14f"
+    mock_load_image.assert_called_once_with("http://example.com/cover.jpg")
+
+
+def test_pick_bar_color_skips_dark():
+    """Test that dark palette colours are skipped only when asked."""
+    from api.view import pick_bar_color
+
+    palette = [(10, 10, 10), (200, 100, 50)]
+
+    assert pick_bar_color(palette, True) == "c86432"
+    assert pick_bar_color(palette, False) == "0a0a0a"
+    assert pick_bar_color([(10, 10, 10)], True) == "53b14f"
+
+
+@patch('api.view.load_image')
+def test_load_cover_reads_shared_disk_store(mock_load_image, tmp_path):
+    """Test that a cover processed by another worker is read from disk."""
+    from api import view
+    from util.diskstore import DiskStore
+
+    mock_load_image.return_value = make_cover_bytes()
+    with patch('api.view.COVER_STORE', DiskStore(str(tmp_path), 1024 * 1024)):
+        view.COVER_CACHE.clear()
+        cover = view.load_cover("http://example.com/shared.jpg")
+
+        # A fresh worker has an empty memory cache but shares the disk store
+        view.COVER_CACHE.clear()
+        shared = view.load_cover("http://example.com/shared.jpg")
+
+    assert shared["img_b64"] == cover["img_b64"]
+    mock_load_image.assert_called_once()
+
+
+def test_make_svg_embeds_cover_mime_type(client):
+    """Test that the cover data URI uses the encoder's mime type."""
+    from api.view import app, make_svg
+
+    with app.app_context():
+        svg = make_svg("Artist", "Song", "abcd", True, True, "default", "53b14f",
+                       False, "0d1117", "light", 0, 1, "image/webp")
+
+    assert 'src="data:image/webp;base64,abcd"' in svg
+
+
+@pytest.mark.parametrize("theme,scale,expected", [
+    ("default", 1, 300),
+    ("natemoo-re", 1, 64),
+    ("natemoo-re", 2, 128),
+    ("novatorem", 2, 160),
+    ("unknown-theme", 1, 200),
+])
+def test_theme_cover_size(theme, scale, expected):
+    """Test that covers are sized to each theme's display size."""
+    from api.view import theme_cover_size
+
+    with patch('api.view.COVER_SCALE', scale):
+        assert theme_cover_size(theme) == expected
+
+
+@patch('api.view.load_image')
+def test_load_cover_keys_artifacts_by_size(mock_load_image):
+    """Test that the same cover at two sizes is processed separately."""
+    from api import view
+
+    view.COVER_CACHE.clear()
+    mock_load_image.return_value = make_cover_bytes()
+
+    small = view.load_cover("http://example.com/sized.jpg", 64)
+    large = view.load_cover("http://example.com/sized.jpg", 300)
+
+    assert small is not large
+    assert len(small["img_b64"]) < len(large["img_b64"])
+    assert mock_load_image.call_count == 2
+
+
+def test_generate_css_bar_is_deterministic():
+    """Test that bar CSS is identical across calls, workers and restarts."""
+    from api.view import generate_css_bar
+
+    assert generate_css_bar(75, "default") == generate_css_bar(75, "default")
+    assert generate_css_bar(75, "default") != generate_css_bar(75, "novatorem")
+
+
+def test_generate_compact_css_bar():
+    """Test that compact bar CSS uses a handful of shared animation rules."""
+    from api.view import generate_compact_css_bar, generate_css_bar, BAR_ANIMATION_GROUPS
+
+    css = generate_compact_css_bar(75, "default")
+
+    assert css.count("animation-duration") == BAR_ANIMATION_GROUPS
+    assert "nth-child({}n+1)".format(BAR_ANIMATION_GROUPS) in css
+    assert "gap: 1px" in css
+    assert "gap: 2px" in generate_compact_css_bar(75, "novatorem", bar_width=2)
+    assert len(css) < len(generate_css_bar(75, "default")) / 4
+
+
+def test_make_svg_uses_precomputed_bars(client):
+    """Test that rendered cards embed the precomputed bar markup and CSS."""
+    from api.view import app, make_svg, CSS_BARS, CONTENT_BAR
+
+    with app.app_context():
+        svg = make_svg("Artist", "Song", "", True, False, "default", "53b14f",
+                       False, "0d1117", "light", 0, 1)
+
+    assert CSS_BARS["default"] in svg
+    assert CONTENT_BAR in svg
+
+
+@patch('api.view.db')
+def test_get_access_token_reads_through_token_cache(mock_db):
+    """Test that Firestore is only read when the token cache misses."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc = mock_db.collection.return_value.document.return_value.get.return_value
+    doc.exists = True
+    doc.to_dict.return_value = {"access_token": "fresh", "refresh_token": "r", "expired_ts": view.time() + 600}
+
+    assert view.get_access_token("cached_uid") == "fresh"
+    assert view.get_access_token("cached_uid") == "fresh"
+    assert mock_db.collection.return_value.document.return_value.get.call_count == 1
+
+
+@patch('api.view.spotify.refresh_token')
+@patch('api.view.db')
+def test_refresh_ahead(mock_db, mock_refresh_token):
+    """Test that background refresh renews near-expiry tokens and skips fresh ones."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = True
+    doc_ref.get.return_value.to_dict.return_value = {
+        "access_token": "old", "refresh_token": "r", "expired_ts": view.time() + 30,
+    }
+    mock_refresh_token.return_value = {"access_token": "new", "expires_in": 3600}
+
+    assert view.refresh_ahead("ahead_uid") is True
+    assert view.TOKEN_CACHE.get("ahead_uid")["access_token"] == "new"
+    written = doc_ref.update.call_args[0][0]
+    assert written["access_token"] == "new"
+    assert "refresh_token" not in written
+    doc_ref.set.assert_not_called()
+
+    # Already refreshed by someone else: only picks up the stored token
+    mock_refresh_token.reset_mock()
+    doc_ref.get.return_value.to_dict.return_value = {
+        "access_token": "other", "refresh_token": "r", "expired_ts": view.time() + 3600,
+    }
+    assert view.refresh_ahead("ahead_uid") == view.REFRESH_SKIPPED
+    mock_refresh_token.assert_not_called()
+    assert view.TOKEN_CACHE.get("ahead_uid")["access_token"] == "other"
+
+    # Another worker holds the lease: skipped, not refreshed
+    doc_ref.get.return_value.to_dict.return_value = {
+        "access_token": "old", "refresh_token": "r", "expired_ts": view.time() + 30,
+    }
+    with patch.object(view.REFRESH_LEASE, 'acquire', return_value=(False, {"expired_ts": 0})):
+        assert view.refresh_ahead("ahead_uid") == view.REFRESH_SKIPPED
+    mock_refresh_token.assert_not_called()
+
+    doc_ref.get.return_value.exists = False
+    assert view.refresh_ahead("ahead_uid") is False
+
+
+@patch('api.view.db')
+def test_refresh_ahead_skips_negative_uids(mock_db):
+    """Test that uids without a stored token are neither tracked nor read from Firestore."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = False
+
+    assert view.refresh_ahead("gone_uid") is False
+    assert view.refresh_ahead("gone_uid") is False
+    assert doc_ref.get.call_count == 1
+
+    refresher = MagicMock()
+    with patch('api.view.TOKEN_REFRESHER', refresher):
+        view.track_view({"uid": "gone_uid"}, "gone_uid:key")
+    refresher.touch.assert_not_called()
+
+
+@patch('api.view.REFRESH_LEASE_POLL', 0)
+@patch('api.view.spotify.refresh_token')
+@patch('api.view.db')
+def test_get_access_token_waits_for_lease_holder(mock_db, mock_refresh_token):
+    """Test that a worker without the refresh lease re-reads the token instead of refreshing."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = True
+    old = {"access_token": "old", "refresh_token": "r", "expired_ts": view.time() - 10}
+    doc_ref.get.return_value.to_dict.side_effect = [
+        old,
+        {"access_token": "new", "refresh_token": "r", "expired_ts": view.time() + 3600},
+    ]
+
+    with patch.object(view.REFRESH_LEASE, 'acquire', return_value=(False, old)):
+        assert view.get_access_token("leased_uid") == "new"
+
+    mock_refresh_token.assert_not_called()
+    doc_ref.set.assert_not_called()
+
+
+@patch('api.view.REFRESH_LEASE_WAIT', 0)
+@patch('api.view.spotify.refresh_token')
+@patch('api.view.db')
+def test_refresh_without_lease_keeps_holders_lease(mock_db, mock_refresh_token):
+    """Test that refreshing anyway after the wait times out never releases another worker's lease."""
+    from api import view
+
+    doc_ref = mock_db.collection.return_value.document.return_value
+    token_info = {"access_token": "old", "refresh_token": "r", "expired_ts": view.time() - 10}
+    mock_refresh_token.return_value = {"error": "server_error"}
+
+    with patch.object(view.REFRESH_LEASE, 'acquire', return_value=(False, token_info)), \
+            patch.object(view.REFRESH_LEASE, 'release') as mock_release:
+        with pytest.raises(view.spotify.InvalidTokenError):
+            view.refresh_access_token("leased_uid", doc_ref, token_info)
+
+        mock_refresh_token.side_effect = Exception("network")
+        with pytest.raises(Exception):
+            view.refresh_access_token("leased_uid", doc_ref, token_info)
+
+    mock_release.assert_not_called()
+
+
+@patch('api.view.spotify.refresh_token')
+@patch('api.view.db')
+def test_refresh_uses_token_stored_by_lease_holder(mock_db, mock_refresh_token):
+    """Test that a worker losing the race to a finished refresh uses the stored token."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    token_info = {"access_token": "old", "refresh_token": "r", "expired_ts": view.time() - 10}
+    # Inside the lease transaction the holder's fresh token is already there
+    doc_ref.get.return_value.exists = True
+    doc_ref.get.return_value.to_dict.return_value = {
+        "access_token": "new", "refresh_token": "r", "expired_ts": view.time() + 3600,
+    }
+
+    assert view.refresh_access_token("raced_uid", doc_ref, token_info) == "new"
+    mock_refresh_token.assert_not_called()
+    doc_ref.update.assert_not_called()
+
+
+@patch('api.view.spotify.refresh_token')
+@patch('api.view.db')
+def test_refresh_when_lease_errors(mock_db, mock_refresh_token):
+    """Test that a failing lease transaction falls back to an unleased refresh."""
+    from api import view
+
+    doc_ref = mock_db.collection.return_value.document.return_value
+    token_info = {"access_token": "old", "refresh_token": "r", "expired_ts": view.time() - 10}
+    mock_refresh_token.return_value = {"access_token": "new", "expires_in": 3600}
+
+    with patch.object(view.REFRESH_LEASE, 'acquire', side_effect=Exception("aborted")):
+        assert view.refresh_access_token("flaky_uid", doc_ref, token_info) == "new"
+
+    written = doc_ref.update.call_args[0][0]
+    assert set(written) == {"access_token", "expired_ts"}
+
+
+@patch('api.view.get_song_info')
+def test_playback_state_shared_between_variants(mock_get_song_info, client):
+    """Test that different themes and colours of one uid's card share one Spotify fetch."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    hits = view.PLAYBACK_STATE.hits
+    mock_get_song_info.return_value = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {"name": "Shared Song", "artists": [{"name": "Shared Artist"}], "album": {"images": []}},
+    }
+
+    for query in ("theme=default", "theme=compact", "theme=compact&background_color=000000"):
+        response = client.get(f'/?uid=state_user&{query}')
+        assert b"Shared Song" in response.data
+
+    mock_get_song_info.assert_called_once_with("state_user")
+    assert view.PLAYBACK_STATE.hits - hits == 2
+
+
+@patch('api.view.get_song_info')
+def test_conditional_get_returns_not_modified(mock_get_song_info, client):
+    """Test that cards carry an ETag and a matching If-None-Match gets 304."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    song_info = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {"id": "track1", "name": "Etag Song", "artists": [{"name": "Artist"}], "album": {"images": []}},
+    }
+    mock_get_song_info.return_value = song_info
+
+    response = client.get('/?uid=etag_user')
+    etag = response.headers["ETag"]
+    assert response.status_code == 200
+
+    # Served from the response cache
+    response = client.get('/?uid=etag_user', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.data == b""
+
+    # Freshly built for the same track still matches
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    response = client.get('/?uid=etag_user', headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+    # A different track or render params change the ETag
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    mock_get_song_info.return_value = dict(song_info, item=dict(song_info["item"], id="track2", name="Other"))
+    assert client.get('/?uid=etag_user', headers={"If-None-Match": etag}).status_code == 200
+    assert client.get('/?uid=etag_user&theme=compact', headers={"If-None-Match": etag}).status_code == 200
+
+
+@patch('api.view.get_song_info')
+def test_stale_card_served_while_revalidating(mock_get_song_info, client):
+    """Test that an expired card is served at once and rebuilt in the background."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    mock_get_song_info.return_value = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {"id": "new", "name": "New Song", "artists": [{"name": "Artist"}], "album": {"images": []}},
+    }
+    cache_key = view.make_cache_key(view.parse_params({"uid": "swr_user"}))
+    view.cache_svg(cache_key, "<svg>old</svg>", "old", view.time() - view.SVG_CACHE_TTL - 1)
+
+    response = client.get('/?uid=swr_user')
+    assert response.data == b"<svg>old</svg>"
+
+    deadline = view.time() + 5
+    while cache_key in view.REVALIDATING and view.time() < deadline:
+        view.sleep(0.01)
+    (svg, etag, encoded, fresh_until), fresh = view.get_cached_svg(cache_key, view.time())
+    assert fresh
+    assert "New Song" in svg
+
+
+def test_revalidation_capped(client):
+    """Test that no background rebuild starts beyond REVALIDATE_CONCURRENCY."""
+    from api import view
+
+    with patch('api.view.REVALIDATE_CONCURRENCY', 0), patch('api.view.REVALIDATE_EXECUTOR') as mock_executor:
+        assert view.revalidate_svg(view.parse_params({"uid": "busy"}), "busy-key") is False
+    mock_executor.submit.assert_not_called()
+
+
+@patch('api.view.db')
+def test_unknown_uid_negative_cached(mock_db):
+    """Test that a uid without a Firestore document is only looked up once."""
+    from api import view
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = False
+
+    assert view.get_access_token("missing_uid") is None
+    assert view.get_access_token("missing_uid") is None
+    assert doc_ref.get.call_count == 1
+
+    # A token written after login wins over the negative entry
+    view.TOKEN_CACHE.set("missing_uid", {"access_token": "new", "expired_ts": view.time() + 600})
+    assert view.get_access_token("missing_uid") == "new"
+
+
+@patch('api.view.db')
+def test_uid_connects_after_negative_cache(mock_db):
+    """Test that a uid negative-cached before its login is served once it connects."""
+    from api import view
+    from util.bloom import AgingBloomFilter
+
+    view.TOKEN_CACHE.clear()
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = False
+
+    with patch('api.view.NEGATIVE_UIDS', AgingBloomFilter(100, 0.001, ttl=0.05)):
+        assert view.get_access_token("late_uid") is None
+
+        # The callback (another process, memory:// cache) creates the document
+        doc_ref.get.return_value.exists = True
+        doc_ref.get.return_value.to_dict.return_value = {
+            "access_token": "late", "refresh_token": "r", "expired_ts": view.time() + 3600,
+        }
+        assert view.get_access_token("late_uid") is None
+        view.sleep(0.11)
+        assert view.get_access_token("late_uid") == "late"
+
+
+def test_negative_cache_ttl_follows_token_cache():
+    """Test that the long negative TTL is only the default with a shared token cache."""
+    from api import view
+    from util.token_cache import make_token_cache
+
+    assert make_token_cache("memory://").shared is False
+    assert make_token_cache("sqlite:///dev/null").shared is True
+    if not view.TOKEN_CACHE.shared and "NEGATIVE_CACHE_TTL" not in os.environ:
+        assert view.NEGATIVE_CACHE_TTL == view.SVG_CACHE_TTL
+
+
+@patch('api.view.get_song_info')
+def test_rate_limited_renders_last_known_state(mock_get_song_info, client):
+    """Test that new variants are rendered from stale playback state while rate limited."""
+    from api import view
+    from util.spotify import RateLimitedError
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    song_info = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {"id": "t", "name": "Known Song", "artists": [{"name": "Artist"}], "album": {"images": []}},
+    }
+    state = {"song_info": song_info, "covers": {}, "fresh_until": view.time() - 1}
+    view.PLAYBACK_STATE.put("limited_user", state, 100, ttl=1, now=view.time() - 2)
+    mock_get_song_info.side_effect = RateLimitedError(30)
+
+    response = client.get('/?uid=limited_user&theme=compact')
+
+    assert b"Known Song" in response.data
+    mock_get_song_info.assert_called_once()
+
+
+def test_response_cache_serves_precompressed(client):
+    """Test that cached cards are served gzip-encoded from the cache by Accept-Encoding."""
+    import gzip
+    from api import view
+
+    view.SVG_CACHE.clear()
+    cache_key = view.make_cache_key(view.parse_params({"uid": "gzip_user"}))
+    view.cache_svg(cache_key, "<svg>compressed</svg>", "etag1", view.time())
+
+    response = client.get('/?uid=gzip_user', headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert gzip.decompress(response.data) == b"<svg>compressed</svg>"
+    assert response.headers["ETag"] == '"etag1-gzip"'
+
+    response = client.get('/?uid=gzip_user')
+    assert "Content-Encoding" not in response.headers
+    assert response.data == b"<svg>compressed</svg>"
+    assert response.headers["ETag"] == '"etag1"'
+
+
+@patch('api.view.get_song_info')
+def test_prerender_variants_fills_response_cache(mock_get_song_info):
+    """Test that the hot set poller callback refreshes state and renders each variant."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    mock_get_song_info.return_value = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "duration_ms": 240000,
+        "item": {"id": "hot", "name": "Hot Song", "artists": [{"name": "Artist"}], "album": {"images": []}},
+    }
+    variants = []
+    for theme in ("default", "compact"):
+        params = view.parse_params({"uid": "hot_user", "theme": theme})
+        variants.append((view.make_cache_key(params), params))
+
+    with view.app.app_context():
+        view.prerender_variants("hot_user", variants)
+
+    mock_get_song_info.assert_called_once_with("hot_user")
+    for cache_key, _ in variants:
+        (svg, etag, encoded, fresh_until), fresh = view.get_cached_svg(cache_key, view.time())
+        assert fresh
+        assert "Hot Song" in svg
+
+
+@pytest.mark.parametrize("song_info, expected", [
+    ({"is_now_playing": True, "progress_ms": 60000, "duration_ms": 120000}, 61),
+    ({"is_now_playing": True, "progress_ms": 119000, "duration_ms": 120000}, 10),
+    ({"is_now_playing": True, "progress_ms": 0, "duration_ms": 3600000}, 180),
+    ({"is_now_playing": False, "progress_ms": 0, "duration_ms": 1}, 300),
+    ({"error": "no_token", "is_now_playing": False}, 30),
+    ({"error": "invalid_token", "is_now_playing": False}, 30),
+])
+def test_playback_ttl(song_info, expected):
+    """Test that freshness follows the remaining track time within the bounds."""
+    from api import view
+
+    with patch('api.view.TRACK_TTL_MIN', 10), patch('api.view.TRACK_TTL_MAX', 180), patch('api.view.OFFLINE_TTL', 300), \
+            patch('api.view.SVG_CACHE_TTL', 30):
+        assert view.playback_ttl(song_info) == expected
+
+
+@patch('api.view.get_song_info')
+def test_cache_lifetime_follows_track(mock_get_song_info, client):
+    """Test that the cached card and its Cache-Control expire when the track ends."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    mock_get_song_info.return_value = {
+        "is_now_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 100000,
+        "duration_ms": 160000,
+        "item": {"id": "t", "name": "Long Song", "artists": [{"name": "Artist"}], "album": {"images": []}},
+    }
+
+    with patch('api.view.TRACK_TTL_MAX', 180):
+        response = client.get('/?uid=ttl_user')
+
+    max_age = int(response.headers["Cache-Control"].split(",")[0].split("=")[1])
+    assert 59 <= max_age <= 61
+    cache_key = view.make_cache_key(view.parse_params({"uid": "ttl_user"}))
+    assert view.get_cached_svg(cache_key, view.time() + 55)[1] is True
+    assert view.get_cached_svg(cache_key, view.time() + 65)[1] is False
+
+
+@patch('api.view.get_song_info')
+def test_metrics_route(mock_get_song_info, client):
+    """Test that /metrics exposes stage latencies and cache counters."""
+    from api import view
+
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    mock_get_song_info.return_value = view.song_info_error("no_token", "Not authenticated")
+    client.get('/?uid=metrics_user')
+    client.get('/?uid=metrics_user')
+
+    with patch('api.view.METRICS_TOKEN', "secret"):
+        response = client.get('/metrics', headers={"Authorization": "Bearer secret"})
+    text = response.data.decode()
+
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    assert 'spotify_profile_stage_seconds_count{stage="render"}' in text
+    assert 'spotify_profile_stage_seconds_bucket{stage="request",le="+Inf"}' in text
+    assert 'spotify_profile_cache_hits_total{cache="svg"}' in text
+    assert 'spotify_profile_flight_calls_total{flight="playback_state"}' in text
+    assert "Not authenticated" not in text
+
+
+def test_metrics_route_gated(client):
+    """Test that /metrics is off by default and needs the bearer token when on."""
+    response = client.get('/metrics')
+    assert b"spotify_profile_stage_seconds" not in response.data
+
+    with patch('api.view.METRICS_TOKEN', "secret"):
+        assert client.get('/metrics').status_code == 403
+        assert client.get('/metrics', headers={"Authorization": "Bearer wrong"}).status_code == 403
+
+
+def test_process_cover_times_decode_in_decode_stage():
+    """Test that the pixel decode is recorded under the decode stage, not palette."""
+    import io
+    from PIL import Image
+    from api import view
+    from util.metrics import STAGE_SECONDS
+
+    buffered = io.BytesIO()
+    Image.new("RGB", (640, 640), (200, 100, 50)).save(buffered, format="JPEG")
+    decoded_before_palette = []
+
+    def palette(img, *args, **kwargs):
+        decoded_before_palette.append(img.tile == [])
+        return [(200, 100, 50)]
+
+    decodes = STAGE_SECONDS.count("decode")
+    with patch('api.view.extract_palette', side_effect=palette):
+        view.process_cover(buffered.getvalue(), 150)
+
+    assert decoded_before_palette == [True]
+    assert STAGE_SECONDS.count("decode") - decodes == 1
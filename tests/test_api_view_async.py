@@ -0,0 +1,194 @@
+import asyncio
+import pytest
+from unittest.mock import patch
+import sys
+import os
+
+# Add the parent directory to the path to import the api module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def call_asgi(app, path="/", query_string=b"", method="GET", headers=()):
+    """Drive an ASGI app with a single HTTP request and collect the response."""
+    scope = {"type": "http", "method": method, "path": path, "query_string": query_string, "headers": list(headers)}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start, body = messages
+    return start["status"], dict(start["headers"]), body["body"]
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    from api import view
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+    yield
+    view.SVG_CACHE.clear()
+    view.PLAYBACK_STATE.clear()
+
+
+def test_async_view_without_uid():
+    """Test that the async app renders the offline card without a uid."""
+    from api.view_async import app
+
+    status, headers, body = call_asgi(app)
+
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"image/svg+xml")
+    assert b"Not Playing" in body
+
+
+@patch('api.view.get_access_token', return_value="token")
+@patch('util.spotify.get_recently_play')
+@patch('util.spotify.get_now_playing')
+def test_async_view_now_playing(mock_now_playing, mock_recently_play, mock_get_access_token):
+    """Test that the async app awaits Spotify and renders the playing track."""
+    from api.view_async import app
+
+    mock_now_playing.return_value = {
+        "is_playing": True,
+        "currently_playing_type": "track",
+        "progress_ms": 1000,
+        "item": {
+            "name": "Test Song",
+            "artists": [{"name": "Test Artist"}],
+            "album": {"images": []},
+            "duration_ms": 240000,
+        },
+    }
+
+    status, headers, body = call_asgi(app, query_string=b"uid=test_user&theme=compact")
+
+    assert status == 200
+    assert b"Test Song" in body
+    assert b"Test Artist" in body
+    mock_get_access_token.assert_called_once_with("test_user")
+    mock_recently_play.assert_not_called()
+
+
+@patch('api.view.get_access_token', return_value="token")
+@patch('util.spotify.get_recently_play')
+@patch('util.spotify.get_now_playing')
+def test_async_view_falls_back_to_recently_played(mock_now_playing, mock_recently_play, mock_get_access_token):
+    """Test that the async app fetches recently played when nothing is playing."""
+    from api.view_async import app
+
+    mock_now_playing.return_value = {"is_playing": False}
+    mock_recently_play.return_value = {
+        "items": [{"track": {
+            "type": "track",
+            "name": "Old Song",
+            "artists": [{"name": "Old Artist"}],
+            "album": {"images": []},
+            "duration_ms": 1000,
+        }}],
+    }
+
+    status, headers, body = call_asgi(app, query_string=b"uid=test_user")
+
+    assert status == 200
+    assert b"Old Song" in body
+    assert b"Recently played" in body
+
+
+def test_async_view_shares_sync_cache():
+    """Test that the async app serves entries cached by the sync app."""
+    from api import view
+    from api.view_async import app
+
+    params = view.parse_params({"uid": "cached_user"})
+    view.cache_svg(view.make_cache_key(params), "<svg>cached</svg>", "cached-etag", view.time())
+
+    status, headers, body = call_asgi(app, query_string=b"uid=cached_user")
+
+    assert body == b"<svg>cached</svg>"
+
+
+def test_async_view_rejects_post():
+    """Test that only GET and HEAD are served."""
+    from api.view_async import app
+
+    status, headers, body = call_asgi(app, method="POST")
+
+    assert status == 405
+
+
+def test_async_view_conditional_get():
+    """Test that a matching If-None-Match gets 304 without a body."""
+    from api import view
+    from api.view_async import app
+
+    params = view.parse_params({"uid": "etag_user"})
+    view.cache_svg(view.make_cache_key(params), "<svg>cached</svg>", "abc", view.time())
+
+    status, headers, body = call_asgi(app, query_string=b"uid=etag_user")
+    assert status == 200
+    assert headers[b"etag"] == b'"abc"'
+
+    status, headers, body = call_asgi(app, query_string=b"uid=etag_user", headers=[(b"if-none-match", b'W/"x", "abc"')])
+    assert status == 304
+    assert body == b""
+    assert b"content-length" not in headers
+
+
+def test_async_view_serves_precompressed():
+    """Test that the async app serves the stored gzip encoding."""
+    import gzip
+    from api import view
+    from api.view_async import app
+
+    params = view.parse_params({"uid": "gzip_user"})
+    view.cache_svg(view.make_cache_key(params), "<svg>cached</svg>", "abc", view.time())
+
+    status, headers, body = call_asgi(app, query_string=b"uid=gzip_user", headers=[(b"accept-encoding", b"gzip")])
+
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"etag"] == b'"abc-gzip"'
+    assert gzip.decompress(body) == b"<svg>cached</svg>"
+
+
+def test_async_view_metrics():
+    """Test that the async app serves /metrics too, behind the same token."""
+    from api.view_async import app
+
+    call_asgi(app)
+    status, headers, body = call_asgi(app, path="/metrics")
+    assert b"spotify_profile_stage_seconds" not in body
+
+    with patch('api.view.METRICS_TOKEN', "secret"):
+        status, headers, body = call_asgi(app, path="/metrics")
+        assert status == 403
+        status, headers, body = call_asgi(app, path="/metrics", headers=[(b"authorization", b"Bearer secret")])
+
+    assert status == 200
+    assert headers[b"content-type"].startswith(b"text/plain")
+    assert b'spotify_profile_stage_seconds_count{stage="request"}' in body
+
+
+def test_async_load_cover_keeps_store_off_the_loop():
+    """Test that cover store reads and writes run on the I/O pool, not the event loop."""
+    import threading
+    from unittest.mock import MagicMock
+    from api import view, view_async
+
+    threads = []
+    store = MagicMock()
+    store.get.side_effect = lambda key: threads.append(threading.current_thread().name)
+    store.put.side_effect = lambda key, data: threads.append(threading.current_thread().name)
+    cover = {"img_b64": "aGVsbG8=", "mime": "image/jpeg", "palette": ["#ffffff"]}
+
+    view.COVER_CACHE.clear()
+    with patch('api.view.COVER_STORE', store), \
+            patch('api.view.load_image', return_value=b"jpeg"), \
+            patch('api.view.process_cover', return_value=cover):
+        assert asyncio.run(view_async.load_cover("https://i.scdn.co/image/store", 150)) == cover
+
+    assert len(threads) == 2
+    assert all(name.startswith("view-io") for name in threads)
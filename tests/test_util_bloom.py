@@ -0,0 +1,49 @@
+import sys
+import os
+from unittest.mock import patch
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_bloom_filter_membership():
+    """Test that added keys are members and the false positive rate is near the target."""
+    from util.bloom import AgingBloomFilter
+
+    bloom = AgingBloomFilter(capacity=1000, error_rate=0.01, ttl=600)
+    for i in range(1000):
+        bloom.add(f"uid{i}")
+
+    assert all(f"uid{i}" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+@patch('util.bloom.time')
+def test_bloom_filter_forgets_after_ttl(mock_time):
+    """Test that members expire after one to two TTLs."""
+    from util.bloom import AgingBloomFilter
+
+    mock_time.return_value = 1000
+    bloom = AgingBloomFilter(capacity=100, error_rate=0.001, ttl=60)
+    bloom.add("gone")
+
+    mock_time.return_value = 1070
+    assert "gone" in bloom
+    mock_time.return_value = 1140
+    assert "gone" not in bloom
+
+
+@patch('util.bloom.time')
+def test_bloom_filter_rotates_at_capacity(mock_time):
+    """Test that a full generation is rotated out instead of saturating."""
+    from util.bloom import AgingBloomFilter
+
+    mock_time.return_value = 1000
+    bloom = AgingBloomFilter(capacity=10, error_rate=0.01, ttl=600)
+    for i in range(25):
+        bloom.add(f"uid{i}")
+
+    assert "uid0" not in bloom
+    assert "uid24" in bloom
+    assert bloom.stats()["members"] == 5
@@ -0,0 +1,125 @@
+import sys
+import os
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_lru_cache_get_put():
+    """Test basic get/put and hit/miss counting."""
+    from util.cache import LRUCache
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", "value", 10)
+
+    assert cache.get("a") == "value"
+    assert cache.get("b") is None
+    assert cache.stats() == {"entries": 1, "bytes": 10, "hits": 1, "misses": 1, "evictions": 0}
+
+
+def test_lru_cache_evicts_least_recently_used_by_bytes():
+    """Test that eviction keeps the total size within the byte budget."""
+    from util.cache import LRUCache
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("b", 2, 40)
+    cache.get("a")
+    cache.put("c", 3, 40)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.total_bytes == 80
+    assert cache.evictions == 1
+
+
+def test_lru_cache_replaces_existing_key():
+    """Test that re-putting a key replaces its size accounting."""
+    from util.cache import LRUCache
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("a", 2, 60)
+
+    assert cache.get("a") == 2
+    assert cache.total_bytes == 60
+
+
+def test_lru_cache_skips_oversized_values():
+    """Test that a value larger than the budget is not stored."""
+    from util.cache import LRUCache
+
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, 101)
+
+    assert "a" not in cache
+    assert cache.total_bytes == 0
+
+
+def test_ttl_cache_expires_entries():
+    """Test that entries are served until their TTL and then dropped."""
+    from util.cache import TTLCache
+
+    cache = TTLCache(max_bytes=100, ttl=30)
+    cache.put("a", "svg", 10, now=1000)
+
+    assert cache.get("a", now=1029) == "svg"
+    assert cache.get("a", now=1030) is None
+    assert "a" not in cache
+    assert cache.total_bytes == 0
+    assert cache.stats()["expirations"] == 1
+
+
+def test_ttl_cache_per_entry_ttl():
+    """Test that put() can override the default TTL."""
+    from util.cache import TTLCache
+
+    cache = TTLCache(max_bytes=100, ttl=30)
+    cache.put("short", 1, 10, ttl=5, now=1000)
+    cache.put("long", 2, 10, now=1000)
+
+    assert cache.get("short", now=1010) is None
+    assert cache.get("long", now=1010) == 2
+
+
+def test_ttl_cache_put_reclaims_expired():
+    """Test that put() reclaims expired entries without them being read."""
+    from util.cache import TTLCache
+
+    cache = TTLCache(max_bytes=1000, ttl=30)
+    for i in range(5):
+        cache.put(i, i, 10, now=1000)
+    cache.put("new", "x", 10, now=2000)
+
+    assert len(cache) == 1
+    assert cache.total_bytes == 10
+    assert cache.evictions == 0
+    assert cache.expirations == 5
+
+
+def test_ttl_cache_evicts_by_bytes():
+    """Test that the byte budget still applies to unexpired entries."""
+    from util.cache import TTLCache
+
+    cache = TTLCache(max_bytes=100, ttl=30)
+    cache.put("a", 1, 60, now=1000)
+    cache.put("b", 2, 60, now=1000)
+
+    assert "a" not in cache
+    assert cache.get("b", now=1001) == 2
+    assert cache.evictions == 1
+
+
+def test_ttl_cache_serves_stale_within_bound():
+    """Test that lookup() returns expired entries as stale until max_stale."""
+    from util.cache import TTLCache
+
+    cache = TTLCache(max_bytes=100, ttl=30, max_stale=60)
+    cache.put("a", "svg", 10, now=1000)
+
+    assert cache.lookup("a", now=1010) == ("svg", True)
+    assert cache.lookup("a", now=1050) == ("svg", False)
+    assert cache.get("a", now=1050) is None
+    assert cache.lookup("a", now=1090) is None
+    assert cache.stats()["stale_hits"] == 2
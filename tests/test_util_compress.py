@@ -0,0 +1,58 @@
+import gzip
+import sys
+import os
+
+import pytest
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+SVG = "<svg>" + "<div class='bar'></div>" * 75 + "</svg>"
+
+
+def test_compress_svg_gzip_roundtrip():
+    """Test that the stored gzip encoding decodes back to the SVG and is smaller."""
+    from util.compress import compress_svg
+
+    encoded = compress_svg(SVG)
+
+    assert gzip.decompress(encoded["gzip"]).decode("utf-8") == SVG
+    assert len(encoded["gzip"]) < len(SVG) / 5
+    # Deterministic, so every worker produces the same bytes
+    assert compress_svg(SVG)["gzip"] == encoded["gzip"]
+
+
+def test_compress_svg_brotli_roundtrip():
+    """Test that a brotli encoding is stored when brotli is installed."""
+    brotli = pytest.importorskip("brotli")
+    from util.compress import compress_svg
+
+    encoded = compress_svg(SVG)
+
+    assert brotli.decompress(encoded["br"]).decode("utf-8") == SVG
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0, gzip", "gzip"),
+    ("*", "br"),
+    ("*, br;q=0", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=abc", None),
+    ("identity", None),
+])
+def test_pick_encoding(accept_encoding, expected):
+    """Test that Accept-Encoding picks the preferred stored encoding."""
+    from util.compress import pick_encoding
+
+    assert pick_encoding(accept_encoding, {"gzip": b"g", "br": b"b"}) == expected
+
+
+def test_pick_encoding_only_stored():
+    """Test that an accepted but not stored encoding is not picked."""
+    from util.compress import pick_encoding
+
+    assert pick_encoding("br, gzip", {"gzip": b"g"}) == "gzip"
+    assert pick_encoding("br", {"gzip": b"g"}) is None
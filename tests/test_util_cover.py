@@ -0,0 +1,115 @@
+import io
+import random
+import sys
+import os
+
+import pytest
+from PIL import Image
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_cover(size=200):
+    rng = random.Random(0)
+    img = Image.new("RGB", (size, size))
+    img.putdata([
+        (x, y, min(255, (x + y) // 2 + rng.randrange(40)))
+        for y in range(size) for x in range(size)
+    ])
+    return img
+
+
+@pytest.mark.parametrize("fmt,mime,pil_format", [
+    ("png", "image/png", "PNG"),
+    ("jpeg", "image/jpeg", "JPEG"),
+    ("webp", "image/webp", "WEBP"),
+])
+def test_encode_cover_formats(fmt, mime, pil_format):
+    """Test that each format encodes to a decodable image with its mime type."""
+    from util.cover import encode_cover
+
+    data, actual_mime = encode_cover(make_cover(), fmt)
+
+    assert actual_mime == mime
+    assert Image.open(io.BytesIO(data)).format == pil_format
+
+
+@pytest.mark.parametrize("fmt", ["jpeg", "webp"])
+def test_encode_cover_fits_byte_budget(fmt):
+    """Test that lossy encoding lowers quality until the budget is met."""
+    from util.cover import encode_cover
+
+    unbounded, _ = encode_cover(make_cover(), fmt)
+    budget = len(unbounded) // 2
+    data, _ = encode_cover(make_cover(), fmt, max_bytes=budget)
+
+    assert len(data) <= budget
+
+
+def test_encode_cover_converts_alpha_for_jpeg():
+    """Test that RGBA covers can be encoded as JPEG."""
+    from util.cover import encode_cover
+
+    data, mime = encode_cover(make_cover().convert("RGBA"), "jpeg", max_bytes=20000)
+
+    assert mime == "image/jpeg"
+
+
+def test_encode_cover_rejects_unknown_format():
+    """Test that an unknown format raises ValueError."""
+    from util.cover import encode_cover
+
+    with pytest.raises(ValueError):
+        encode_cover(make_cover(), "gif")
+
+
+SPOTIFY_IMAGES = [
+    {"height": 640, "url": "https://i.scdn.co/image/640", "width": 640},
+    {"height": 300, "url": "https://i.scdn.co/image/300", "width": 300},
+    {"height": 64, "url": "https://i.scdn.co/image/64", "width": 64},
+]
+
+
+@pytest.mark.parametrize("target_size,expected", [
+    (64, "https://i.scdn.co/image/64"),
+    (65, "https://i.scdn.co/image/300"),
+    (200, "https://i.scdn.co/image/300"),
+    (400, "https://i.scdn.co/image/640"),
+    (1000, "https://i.scdn.co/image/640"),
+])
+def test_select_image_variant(target_size, expected):
+    """Test that the smallest variant at or above the target size is chosen."""
+    from util.cover import select_image_variant
+
+    assert select_image_variant(SPOTIFY_IMAGES, target_size)["url"] == expected
+
+
+def test_select_image_variant_without_dimensions():
+    """Test that variants without sizes are still usable."""
+    from util.cover import select_image_variant
+
+    assert select_image_variant([{"url": "a"}], 200)["url"] == "a"
+    assert select_image_variant([], 200) is None
+    assert select_image_variant(None, 200) is None
+
+
+def test_decode_cover_uses_reduced_jpeg_scale():
+    """Test that large JPEG covers decode at the smallest sufficient scale."""
+    from util.cover import decode_cover
+
+    buffered = io.BytesIO()
+    make_cover(640).save(buffered, format="JPEG")
+
+    assert decode_cover(buffered.getvalue(), 200).size == (320, 320)
+    assert decode_cover(buffered.getvalue(), 64).size == (80, 80)
+
+
+def test_decode_cover_loads_pixels():
+    """Test that the decode happens in decode_cover, not on first use."""
+    from util.cover import decode_cover
+
+    buffered = io.BytesIO()
+    make_cover(640).save(buffered, format="JPEG")
+
+    assert decode_cover(buffered.getvalue(), 200).tile == []
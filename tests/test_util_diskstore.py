@@ -0,0 +1,91 @@
+import sys
+import os
+import time
+from unittest.mock import patch
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_disk_store_round_trip(tmp_path):
+    """Test that stored blobs are readable by key and missing keys return None."""
+    from util.diskstore import DiskStore
+
+    store = DiskStore(str(tmp_path), max_bytes=1024)
+    store.put("http://example.com/cover.jpg@200", b"artifact")
+
+    assert store.get("http://example.com/cover.jpg@200") == b"artifact"
+    assert store.get("missing") is None
+
+
+def test_disk_store_is_shared_between_instances(tmp_path):
+    """Test that a second store on the same directory (another worker) sees writes."""
+    from util.diskstore import DiskStore
+
+    DiskStore(str(tmp_path), max_bytes=1024).put("key", b"artifact")
+
+    assert DiskStore(str(tmp_path), max_bytes=1024).get("key") == b"artifact"
+
+
+def test_disk_store_leaves_no_temp_files(tmp_path):
+    """Test that writes go through a temp file that is renamed into place."""
+    from util.diskstore import DiskStore
+
+    store = DiskStore(str(tmp_path), max_bytes=1024)
+    store.put("key", b"one")
+    store.put("key", b"two")
+
+    names = [name for _, _, files in os.walk(tmp_path) for name in files if name != ".evict.lock"]
+    assert len(names) == 1
+    assert not names[0].startswith(".tmp-")
+    assert store.get("key") == b"two"
+
+
+def test_disk_store_evicts_least_recently_used(tmp_path):
+    """Test that eviction removes the oldest blobs to fit the size cap."""
+    from util.diskstore import DiskStore
+
+    store = DiskStore(str(tmp_path), max_bytes=20)
+    with patch.object(store, "_maybe_evict"):
+        for key in ("a", "b", "c"):
+            store.put(key, b"x" * 10)
+            old = time.time() - 100 + ord(key)
+            os.utime(store._path(key), (old, old))
+    store.get("a")
+
+    assert store.evict() == 20
+    assert store.get("a") is not None
+    assert store.get("b") is None
+    assert store.get("c") is not None
+
+
+def test_disk_store_evicts_in_background_once_over_cap(tmp_path):
+    """Test that puts only count bytes and hand eviction to a background thread."""
+    from util.diskstore import DiskStore
+
+    store = DiskStore(str(tmp_path), max_bytes=25, evict_interval=0)
+    store.evict()
+    with patch.object(store, "evict", wraps=store.evict) as mock_evict:
+        store.put("a", b"x" * 10)
+        store.put("b", b"x" * 10)
+        mock_evict.assert_not_called()
+
+        store.put("c", b"x" * 10)
+        thread = store._evict_thread
+        if thread is not None:
+            thread.join(5)
+
+    mock_evict.assert_called_once()
+    assert store._scanned == 20
+    assert store._pending == 0
+
+
+def test_disk_store_read_survives_eviction_race(tmp_path):
+    """Test that a blob evicted right after it was read is still returned."""
+    from util.diskstore import DiskStore
+
+    store = DiskStore(str(tmp_path), max_bytes=1024)
+    store.put("key", b"artifact")
+
+    with patch("util.diskstore.os.utime", side_effect=FileNotFoundError):
+        assert store.get("key") == b"artifact"
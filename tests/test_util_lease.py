@@ -0,0 +1,104 @@
+import sys
+import os
+from time import time
+from unittest.mock import MagicMock
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_doc_ref(data, exists=True):
+    doc_ref = MagicMock()
+    doc_ref.get.return_value.exists = exists
+    doc_ref.get.return_value.to_dict.return_value = data
+    return doc_ref
+
+
+def test_lease_acquired_when_free():
+    """Test that a free lease is taken inside the transaction."""
+    from util.lease import FirestoreLease
+
+    db = MagicMock()
+    lease = FirestoreLease(db, ttl=10, owner="me")
+    doc_ref = make_doc_ref({"access_token": "a"})
+
+    assert lease.acquire(doc_ref) == (True, {"access_token": "a"})
+    transaction = db.transaction.return_value
+    doc_ref.get.assert_called_with(transaction=transaction)
+    args = transaction.update.call_args[0]
+    assert args[0] is doc_ref
+    assert args[1]["refresh_lease"]["owner"] == "me"
+    assert args[1]["refresh_lease"]["until"] > time()
+
+
+def test_lease_contended_by_other_owner():
+    """Test that a live lease held by someone else is not taken."""
+    from util.lease import FirestoreLease
+
+    db = MagicMock()
+    lease = FirestoreLease(db, owner="me")
+    doc_ref = make_doc_ref({"refresh_lease": {"owner": "other", "until": time() + 5}})
+
+    assert lease.acquire(doc_ref)[0] is False
+    db.transaction.return_value.update.assert_not_called()
+    assert lease.stats() == {"acquired": 0, "contended": 1}
+
+
+def test_lease_expired_is_taken_over():
+    """Test that a lease left behind by a crashed holder can be taken over."""
+    from util.lease import FirestoreLease
+
+    lease = FirestoreLease(MagicMock(), owner="me")
+    doc_ref = make_doc_ref({"refresh_lease": {"owner": "other", "until": time() - 1}})
+
+    assert lease.acquire(doc_ref)[0] is True
+
+
+def test_lease_skipped_when_work_done():
+    """Test that no lease is taken when the document read in the transaction shows the work done."""
+    from util.lease import FirestoreLease
+
+    db = MagicMock()
+    lease = FirestoreLease(db, owner="me")
+    doc_ref = make_doc_ref({"access_token": "new", "expired_ts": 200})
+
+    assert lease.acquire(doc_ref, skip_if=lambda data: data["expired_ts"] > 100) == (False, {"access_token": "new", "expired_ts": 200})
+    db.transaction.return_value.update.assert_not_called()
+    assert lease.stats() == {"acquired": 0, "contended": 0}
+
+
+def test_lease_missing_document():
+    """Test that no lease is taken on a deleted user."""
+    from util.lease import FirestoreLease
+
+    lease = FirestoreLease(MagicMock(), owner="me")
+
+    assert lease.acquire(make_doc_ref(None, exists=False)) == (False, None)
+
+
+def test_lease_release_only_own_lease():
+    """Test that release drops our own lease but leaves another owner's in place."""
+    from util.lease import FirestoreLease
+
+    db = MagicMock()
+    lease = FirestoreLease(db, owner="me")
+    transaction = db.transaction.return_value
+
+    lease.release(make_doc_ref({"refresh_lease": {"owner": "other", "until": time() + 5}}))
+    transaction.update.assert_not_called()
+
+    doc_ref = make_doc_ref({"refresh_lease": {"owner": "me", "until": time() + 5}})
+    lease.release(doc_ref)
+    args = transaction.update.call_args[0]
+    assert args[0] is doc_ref
+    assert list(args[1]) == ["refresh_lease"]
+
+
+def test_lease_releasing():
+    """Test that a token update can drop the lease in the same write."""
+    from google.cloud import firestore
+    from util.lease import FirestoreLease
+
+    lease = FirestoreLease(MagicMock())
+
+    assert lease.releasing({"access_token": "a"}) == {"access_token": "a", "refresh_lease": firestore.DELETE_FIELD}
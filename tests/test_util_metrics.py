@@ -0,0 +1,62 @@
+import sys
+import os
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_histogram_cumulative_buckets():
+    """Test that bucket counts are cumulative and end with +Inf."""
+    from util.metrics import Histogram
+
+    histogram = Histogram("latency_seconds", "Latency.", labels=("stage",), buckets=(0.1, 1))
+    histogram.observe(0.05, "render")
+    histogram.observe(0.5, "render")
+    histogram.observe(5, "render")
+
+    samples = {(name, labels): value for name, labels, value in histogram.samples()}
+    assert samples[("latency_seconds_bucket", '{stage="render",le="0.1"}')] == 1
+    assert samples[("latency_seconds_bucket", '{stage="render",le="1"}')] == 2
+    assert samples[("latency_seconds_bucket", '{stage="render",le="+Inf"}')] == 3
+    assert samples[("latency_seconds_count", '{stage="render"}')] == 3
+    assert samples[("latency_seconds_sum", '{stage="render"}')] == 5.55
+
+
+def test_timed_records_stage():
+    """Test that timed() observes the block's duration under its stage."""
+    from util.metrics import STAGE_SECONDS, timed
+
+    before = STAGE_SECONDS.count("test_stage")
+    with timed("test_stage"):
+        pass
+
+    assert STAGE_SECONDS.count("test_stage") == before + 1
+
+
+def test_render_groups_extra_samples():
+    """Test the text format, with extra samples of one metric kept together."""
+    from util.metrics import Counter, render
+
+    counter = Counter("requests_total", "Requests.", labels=("code",))
+    counter.inc("200")
+    counter.inc("200")
+    extra = [
+        ("hits_total", "counter", "Hits.", {"cache": "a"}, 1),
+        ("bytes", "gauge", "Bytes.", {"cache": "a"}, 10),
+        ("hits_total", "counter", "Hits.", {"cache": "b"}, 2),
+    ]
+
+    text = render([counter], extra)
+
+    assert text.splitlines() == [
+        "# HELP requests_total Requests.",
+        "# TYPE requests_total counter",
+        'requests_total{code="200"} 2',
+        "# HELP hits_total Hits.",
+        "# TYPE hits_total counter",
+        'hits_total{cache="a"} 1',
+        'hits_total{cache="b"} 2',
+        "# HELP bytes Bytes.",
+        "# TYPE bytes gauge",
+        'bytes{cache="a"} 10',
+    ]
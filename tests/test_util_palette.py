@@ -0,0 +1,69 @@
+import random
+import time
+import sys
+import os
+from unittest.mock import patch
+
+import pytest
+from PIL import Image
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_image(seed, size=40):
+    rng = random.Random(seed)
+    img = Image.new("RGB", (size, size))
+    img.putdata([
+        tuple(rng.randrange(256) for _ in range(3)) if rng.random() < 0.5
+        else (rng.choice([0, 128, 255]), rng.choice([0, 255]), rng.choice([0, 50, 255]))
+        for _ in range(size * size)
+    ])
+    return img
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_numpy_palette_matches_colorgram(seed):
+    """Test that the vectorized buckets give colorgram's exact palette."""
+    # colorgram is the reference implementation, not a dependency
+    colorgram = pytest.importorskip("colorgram")
+    from util.palette import extract_palette
+
+    img = make_image(seed)
+    expected = [tuple(color.rgb) for color in colorgram.extract(img, 10)]
+
+    assert extract_palette(img, 10, thumbnail_size=img.width) == expected
+
+
+def test_palette_of_flat_cover():
+    """Test that a single colour cover yields that colour."""
+    from util.palette import extract_palette
+
+    img = Image.new("RGB", (640, 640), (200, 100, 50))
+
+    assert extract_palette(img, 10) == [(200, 100, 50)]
+
+
+def test_palette_time_budget():
+    """Test that exceeding the time budget raises PaletteTimeout."""
+    from util.palette import extract_palette, PaletteTimeout
+
+    with pytest.raises(PaletteTimeout):
+        extract_palette(make_image(0), 10, time_budget=0)
+
+
+def test_palette_kept_once_computed():
+    """Test that a palette finished past the budget is returned, not thrown away."""
+    from util import palette
+
+    # Started at 0, both checks at 0; any later clock read is past the budget
+    with patch('util.palette.time.perf_counter', side_effect=[0, 0, 0, 10, 10]):
+        assert palette.extract_palette(make_image(0), 10, time_budget=1)
+
+
+def test_palette_budget_includes_decode():
+    """Test that time spent before the call (the decode) counts against the budget."""
+    from util.palette import extract_palette, PaletteTimeout
+
+    with pytest.raises(PaletteTimeout):
+        extract_palette(make_image(0), 10, time_budget=1, started=time.perf_counter() - 2)
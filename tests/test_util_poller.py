@@ -0,0 +1,70 @@
+import sys
+import os
+from time import time
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_poller(polled, **kwargs):
+    from util.poller import HotSetPoller
+
+    poller = HotSetPoller(lambda uid, variants: polled.append((uid, variants)), interval=3600, **kwargs)
+    # Record views without starting the background thread
+    poller._thread = object()
+    return poller
+
+
+def test_hot_set_most_viewed_within_budget():
+    """Test that only the most viewed uids, up to the budget, are polled."""
+    poller = make_poller([], budget=2)
+    for uid, views in (("a", 5), ("b", 1), ("c", 3)):
+        for _ in range(views):
+            poller.touch(uid, f"{uid}:default", {"uid": uid})
+
+    assert [uid for uid, _ in poller.hot_set()] == ["a", "c"]
+
+
+def test_hot_set_most_requested_variants():
+    """Test that each uid's most requested variants are re-rendered."""
+    poller = make_poller([], max_variants=2)
+    for key, views in (("u:default", 3), ("u:compact", 5), ("u:apple", 1)):
+        for _ in range(views):
+            poller.touch("u", key, {"uid": "u", "theme": key[2:]})
+
+    (uid, variants), = poller.hot_set()
+    assert [key for key, _ in variants] == ["u:compact", "u:default"]
+    assert variants[0][1]["theme"] == "compact"
+
+
+def test_hot_set_decays_and_forgets():
+    """Test that counts decay each cycle and idle uids are dropped."""
+    poller = make_poller([], budget=1, active_window=600)
+    for _ in range(4):
+        poller.touch("old", "old:default", {})
+    poller.touch("new", "new:default", {})
+
+    assert poller.hot_set()[0][0] == "old"
+    poller.touch("new", "new:default", {})
+    poller.touch("new", "new:default", {})
+    assert poller.hot_set()[0][0] == "new"
+
+    poller._last_seen["old"] = time() - 601
+    poller.hot_set()
+    assert "old" not in poller._variant_views
+    assert poller.stats()["tracked"] == 1
+
+
+def test_poll_hot_set_calls_poll():
+    """Test that a cycle polls every hot uid and counts failures."""
+    polled = []
+    poller = make_poller(polled)
+    poller.touch("a", "a:default", {"uid": "a"})
+    poller.poll_hot_set()
+
+    assert polled == [("a", [("a:default", {"uid": "a"})])]
+    assert poller.stats()["polled"] == 1
+
+    poller.poll = lambda uid, variants: 1 / 0
+    poller.poll_hot_set()
+    assert poller.stats()["failed"] == 1
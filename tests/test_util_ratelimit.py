@@ -0,0 +1,81 @@
+import sys
+import os
+from unittest.mock import patch
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+@patch('util.ratelimit.sleep')
+@patch('util.ratelimit.monotonic')
+def test_token_bucket_refills_at_rate(mock_monotonic, mock_sleep):
+    """Test that the bucket allows a burst and then refills at its rate."""
+    from util.ratelimit import TokenBucket
+
+    mock_monotonic.return_value = 100.0
+    bucket = TokenBucket(rate=10, burst=2)
+
+    assert bucket.acquire()
+    assert bucket.acquire()
+    assert not bucket.acquire()
+    assert bucket.throttled == 1
+
+    mock_monotonic.return_value = 100.2
+    assert bucket.acquire()
+
+
+def test_token_bucket_rejects_non_positive_rate():
+    """Test that a bucket that could never refill is refused at construction."""
+    import pytest
+    from util.ratelimit import TokenBucket
+
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0, burst=2)
+
+
+def test_token_bucket_waits_within_timeout():
+    """Test that acquire() waits for a token when the timeout allows it."""
+    from util.ratelimit import TokenBucket
+
+    bucket = TokenBucket(rate=100, burst=1)
+    assert bucket.acquire()
+    assert bucket.acquire(timeout=0.5)
+
+
+@patch('util.ratelimit.monotonic')
+def test_circuit_breaker_opens_after_failures(mock_monotonic):
+    """Test that consecutive failures open the breaker until a probe succeeds."""
+    from util.ratelimit import CircuitBreaker
+
+    mock_monotonic.return_value = 100.0
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+    # One probe after the timeout, then the breaker closes on success
+    mock_monotonic.return_value = 131.0
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+@patch('util.ratelimit.monotonic')
+def test_circuit_breaker_failed_probe_reopens(mock_monotonic):
+    """Test that a failed probe opens the breaker again."""
+    from util.ratelimit import CircuitBreaker
+
+    mock_monotonic.return_value = 100.0
+    breaker = CircuitBreaker(failure_threshold=5, reset_timeout=30)
+    breaker.open_for(10)
+
+    mock_monotonic.return_value = 111.0
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.retry_after() == 30
@@ -0,0 +1,80 @@
+import sys
+import os
+from time import time
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def make_refresher(expiries, refreshed, **kwargs):
+    from util.refresher import TokenRefresher
+
+    def refresh(uid):
+        refreshed.append(uid)
+        return expiries.get(uid) is not None
+
+    options = dict(lead_time=300, jitter=0, interval=3600)
+    options.update(kwargs)
+    return TokenRefresher(refresh, expiries.get, **options)
+
+
+def test_refresher_picks_tokens_close_to_expiry():
+    """Test that only recently viewed uids near expiry are due."""
+    now = time()
+    expiries = {"soon": now + 60, "later": now + 3000, "unknown": None}
+    refresher = make_refresher(expiries, [])
+    for uid in expiries:
+        refresher._last_seen[uid] = now
+
+    assert sorted(refresher.due(now)) == ["soon", "unknown"]
+
+
+def test_refresher_forgets_inactive_uids():
+    """Test that uids not viewed within the active window are dropped."""
+    now = time()
+    refresher = make_refresher({"old": now + 60}, [], active_window=600)
+    refresher._last_seen["old"] = now - 601
+
+    assert refresher.due(now) == []
+    assert refresher.stats()["tracked"] == 0
+
+
+def test_refresher_jitter_spreads_refreshes():
+    """Test that jitter moves the refresh point earlier, up to the jitter."""
+    now = time()
+    refresher = make_refresher({"uid": now + 350}, [], jitter=100)
+    refresher._last_seen["uid"] = now
+    refresher._jitter["uid"] = 60
+
+    assert refresher.due(now) == ["uid"]
+
+    refresher._jitter["uid"] = 10
+    assert refresher.due(now) == []
+
+
+def test_refresher_runs_refresh_and_drops_invalid():
+    """Test that due uids are refreshed and uids without a token are dropped."""
+    now = time()
+    refreshed = []
+    refresher = make_refresher({"valid": now + 10}, refreshed)
+    refresher._last_seen.update({"valid": now, "gone": now})
+
+    refresher.schedule_due()
+    refresher._executor.shutdown(wait=True)
+
+    assert sorted(refreshed) == ["gone", "valid"]
+    assert refresher.stats() == {"tracked": 1, "in_flight": 0, "refreshed": 1, "skipped": 0, "failed": 0}
+
+
+def test_refresher_counts_skipped_refreshes():
+    """Test that a refresh left to another worker is counted as skipped and kept tracked."""
+    from util.refresher import TokenRefresher, SKIPPED
+
+    now = time()
+    refresher = TokenRefresher(lambda uid: SKIPPED, {"busy": now + 10}.get, lead_time=300, jitter=0, interval=3600)
+    refresher._last_seen["busy"] = now
+
+    refresher.schedule_due()
+    refresher._executor.shutdown(wait=True)
+
+    assert refresher.stats() == {"tracked": 1, "in_flight": 0, "refreshed": 0, "skipped": 1, "failed": 0}
@@ -0,0 +1,89 @@
+import asyncio
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    """Test that concurrent calls for one key run the function once."""
+    from util.singleflight import SingleFlight
+
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "svg"
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+    leader.start()
+    started.wait(5)
+
+    followers = [threading.Thread(target=lambda: results.append(flight.do("key", slow))) for _ in range(4)]
+    for t in followers:
+        t.start()
+    while flight.coalesced < 4:
+        time.sleep(0.001)
+    release.set()
+    for t in [leader] + followers:
+        t.join(5)
+
+    assert results == ["svg"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_single_flight_runs_again_after_completion():
+    """Test that a finished call does not cache its result."""
+    from util.singleflight import SingleFlight
+
+    flight = SingleFlight()
+
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.coalesced == 0
+
+
+def test_single_flight_propagates_errors():
+    """Test that the leader's exception is raised and the key is released."""
+    from util.singleflight import SingleFlight
+
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError, match="boom"):
+        flight.do("key", fail)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_async_single_flight_coalesces_concurrent_calls():
+    """Test that concurrent coroutines for one key share one call."""
+    from util.singleflight import AsyncSingleFlight
+
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def slow(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value
+
+    async def main():
+        return await asyncio.gather(*[flight.do("key", slow, "svg") for _ in range(5)])
+
+    assert asyncio.run(main()) == ["svg"] * 5
+    assert calls == ["svg"]
+    assert flight.stats() == {"calls": 1, "coalesced": 4, "in_flight": 0}
@@ -0,0 +1,158 @@
+import sys
+import os
+from unittest.mock import patch, MagicMock
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def test_client_mounts_pool_per_host():
+    """Test that each Spotify host gets its own sized connection pool."""
+    from util.spotify import SpotifyClient, POOLED_HOSTS
+
+    client = SpotifyClient(pool_connections=2, pool_maxsize=7)
+
+    for host in POOLED_HOSTS:
+        adapter = client.session.get_adapter(host + "/")
+        assert adapter._pool_maxsize == 7
+        assert adapter._pool_connections == 2
+
+    assert client.session.get_adapter(POOLED_HOSTS[0]) is not client.session.get_adapter(POOLED_HOSTS[1])
+
+
+def test_client_reuses_session():
+    """Test that the same keep-alive session is reused between calls."""
+    from util.spotify import SpotifyClient
+
+    client = SpotifyClient()
+
+    assert client.session is client.session
+
+
+def test_client_recreates_session_after_fork():
+    """Test that a forked worker does not inherit the parent's sockets."""
+    from util.spotify import SpotifyClient
+
+    client = SpotifyClient()
+    session = client.session
+
+    with patch("os.getpid", return_value=-1):
+        assert client.session is not session
+
+
+def test_client_applies_endpoint_timeout():
+    """Test that each endpoint gets its configured (connect, read) timeout."""
+    from util.spotify import SpotifyClient
+
+    client = SpotifyClient(timeouts={"token": (1, 2), "api": (3, 4)})
+    client._session = MagicMock()
+    client._session.request.return_value.status_code = 200
+    client._pid = os.getpid()
+
+    client.post("https://accounts.spotify.com/api/token", endpoint="token")
+    assert client._session.request.call_args.kwargs["timeout"] == (1, 2)
+
+    client.get("https://api.spotify.com/v1/me")
+    assert client._session.request.call_args.kwargs["timeout"] == (3, 4)
+
+
+@patch("util.spotify.client")
+def test_get_now_playing_uses_shared_client(mock_client):
+    """Test that the module helpers go through the pooled client."""
+    from util import spotify
+
+    mock_client.get.return_value.json.return_value = {"is_playing": True}
+
+    assert spotify.get_now_playing("token") == {"is_playing": True}
+    args, kwargs = mock_client.get.call_args
+    assert args[0] == spotify.SPOTIFY_URL_NOW_PLAYING
+    assert kwargs["headers"] == {"Authorization": "Bearer token"}
+
+
+@patch("util.spotify.client")
+def test_get_now_playing_no_content(mock_client):
+    """Test that a 204 from Spotify is treated as not playing."""
+    from util import spotify
+
+    mock_client.get.return_value.status_code = 204
+    mock_client.get.return_value.json.side_effect = ValueError("empty body")
+
+    assert spotify.get_now_playing("token") == {"is_playing": False}
+
+
+def make_governed_client(status_code=200, headers=None, **kwargs):
+    from util.spotify import SpotifyClient
+
+    client = SpotifyClient(**kwargs)
+    client._session = MagicMock()
+    client._session.request.return_value.status_code = status_code
+    client._session.request.return_value.headers = headers or {}
+    client._pid = os.getpid()
+    return client
+
+
+def test_client_honours_retry_after():
+    """Test that a 429 opens the breaker for Retry-After and later calls are not sent."""
+    import pytest
+    from util.spotify import RateLimitedError
+
+    client = make_governed_client(429, {"Retry-After": "12"})
+
+    with pytest.raises(RateLimitedError) as exc:
+        client.get("https://api.spotify.com/v1/me")
+    assert exc.value.retry_after == 12
+
+    with pytest.raises(RateLimitedError) as exc:
+        client.get("https://api.spotify.com/v1/me")
+    assert 11 < exc.value.retry_after <= 12
+    assert client._session.request.call_count == 1
+    assert client.breaker.stats()["rejected"] == 1
+
+
+def test_client_throttles_with_token_bucket():
+    """Test that calls beyond the bucket's burst are refused without reaching Spotify."""
+    import pytest
+    from util.ratelimit import TokenBucket
+    from util.spotify import RateLimitedError
+
+    client = make_governed_client(bucket=TokenBucket(rate=0.001, burst=2))
+
+    client.get("https://api.spotify.com/v1/me")
+    client.get("https://api.spotify.com/v1/me")
+    with pytest.raises(RateLimitedError):
+        client.get("https://api.spotify.com/v1/me")
+    assert client._session.request.call_count == 2
+
+    # Images are not governed
+    client.get("https://i.scdn.co/image/x", endpoint="image")
+    assert client._session.request.call_count == 3
+
+
+def test_client_rate_limit_zero_disables_bucket():
+    """Test that SPOTIFY_RATE_LIMIT=0 turns the token bucket off instead of dividing by zero."""
+    from unittest.mock import patch
+
+    with patch('util.spotify.SPOTIFY_RATE_LIMIT', 0):
+        client = make_governed_client()
+
+    assert client.bucket is None
+    for _ in range(5):
+        client.get("https://api.spotify.com/v1/me")
+    assert client._session.request.call_count == 5
+
+
+def test_client_counts_upstream_status():
+    """Test that responses are counted by endpoint and status code."""
+    import pytest
+    from util.metrics import UPSTREAM_RESPONSES
+    from util.spotify import RateLimitedError
+
+    before = UPSTREAM_RESPONSES.get("api", "429"), UPSTREAM_RESPONSES.get("api", "rate_limited")
+    client = make_governed_client(429, {"Retry-After": "5"})
+
+    for _ in range(2):
+        with pytest.raises(RateLimitedError):
+            client.get("https://api.spotify.com/v1/me")
+
+    assert UPSTREAM_RESPONSES.get("api", "429") == before[0] + 1
+    assert UPSTREAM_RESPONSES.get("api", "rate_limited") == before[1] + 1
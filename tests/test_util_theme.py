@@ -0,0 +1,94 @@
+import itertools
+import sys
+import os
+
+import pytest
+from jinja2 import DictLoader, Environment, FileSystemLoader
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), "..", "api", "templates")
+THEMES = ["default", "compact", "karaoke", "natemoo-re", "novatorem", "apple", "spotify-embed"]
+
+
+@pytest.fixture
+def renderer():
+    from util.theme import ThemeRenderer
+    return ThemeRenderer(Environment(loader=FileSystemLoader(TEMPLATE_DIR)))
+
+
+def layout_for(cover_image, is_now_playing):
+    return {
+        "height": 470 if cover_image else 145,
+        "cover_image": cover_image,
+        "is_now_playing": is_now_playing,
+        "background_color": "0d1117",
+        "content_bar": "<div class='bar'></div>" * 3 if is_now_playing else "",
+        "css_bar": ".bar:nth-child(1) { left: 1px; }",
+        "title_text": "Now playing" if is_now_playing else "Recently played",
+    }
+
+
+@pytest.mark.parametrize("theme,cover_image,is_now_playing", list(itertools.product(THEMES, [True, False], [True, False])))
+def test_renderer_matches_jinja(renderer, theme, cover_image, is_now_playing):
+    """Test that spliced output is byte-identical to a full Jinja render."""
+    name = f"spotify.{theme}.html.j2"
+    layout = layout_for(cover_image, is_now_playing)
+
+    for song_name in ["Song &amp; Title", "Another much longer song name here"]:
+        dynamic = {
+            "artist_name": "Artist",
+            "song_name": song_name,
+            "img": "aGVsbG8=" if cover_image else "",
+            "img_mime": "image/jpeg",
+            "bar_color": "ff0000",
+            "placeholder_duration": "1:30",
+        }
+        expected = renderer.jinja_env.get_template(name).render(**layout, **dynamic)
+
+        assert renderer.render(name, layout, dynamic) == expected
+
+
+def test_renderer_compiles_once_per_layout(renderer):
+    """Test that the static segments are reused across tracks."""
+    layout = layout_for(True, True)
+    dynamic = {"artist_name": "A", "song_name": "S", "img": "x", "img_mime": "image/png", "bar_color": "fff", "placeholder_duration": "0:06"}
+
+    renderer.render("spotify.default.html.j2", layout, dynamic)
+    renderer.render("spotify.default.html.j2", layout, dict(dynamic, song_name="Other"))
+
+    assert renderer.stats()["entries"] == 1
+    assert renderer.stats()["hits"] == 1
+
+
+def test_renderer_falls_back_for_computed_slots():
+    """Test that templates computing from a dynamic value are not split."""
+    from util.theme import ThemeRenderer, _NOT_SPLITTABLE
+
+    renderer = ThemeRenderer(Environment(loader=DictLoader({
+        "computed.j2": "<svg>{{ song_name }} ({{ song_name|length }})</svg>",
+        "plain.j2": "<svg>{{ song_name }}</svg>",
+    })))
+    dynamic = {"artist_name": "A", "song_name": "Song", "img": "x", "img_mime": "image/png", "bar_color": "fff", "placeholder_duration": "0:06"}
+
+    assert renderer.compile("computed.j2", {}, dynamic) is _NOT_SPLITTABLE
+    assert renderer.render("computed.j2", {}, dynamic) == "<svg>Song (4)</svg>"
+    assert renderer.compile("plain.j2", {}, dynamic) == ("<svg>", "song_name", "</svg>")
+
+
+def test_renderer_ignores_sentinels_in_layout(renderer):
+    """Test that layout values cannot inject fake or real slot markers."""
+    from util.theme import _NOT_SPLITTABLE
+
+    dynamic = {"artist_name": "A", "song_name": "S", "img": "x", "img_mime": "image/png", "bar_color": "fff", "placeholder_duration": "0:06"}
+    for color in ["\x1ea:foo\x1f", "\x1ea:img\x1f"]:
+        layout = dict(layout_for(True, True), background_color=color)
+        svg = renderer.render("spotify.default.html.j2", layout, dynamic)
+
+        clean = dict(layout, background_color=color.strip("\x1e\x1f"))
+        assert svg == renderer.jinja_env.get_template("spotify.default.html.j2").render(**clean, **dynamic)
+
+    # A split naming an unknown slot is not spliced
+    dynamic_renderer = type(renderer)(Environment(loader=DictLoader({"fake.j2": "<svg>{{ song_name }}{{ raw }}</svg>"})))
+    assert dynamic_renderer.compile("fake.j2", {"raw": "\x1ea:foo\x1f"}, dynamic) is _NOT_SPLITTABLE
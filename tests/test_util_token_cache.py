@@ -0,0 +1,165 @@
+import socketserver
+import sys
+import os
+import threading
+import time
+
+import pytest
+
+# Add the parent directory to the path to import the util module
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Tiny Redis stand-in that understands GET, SET (with PX), DEL and SCAN."""
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        store = self.server.store
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            command = args[0].upper()
+            if command == b"GET":
+                entry = store.get(args[1])
+                if entry is None or (entry[1] and entry[1] < time.time()):
+                    self.wfile.write(b"$-1\r\n")
+                else:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(entry[0]), entry[0]))
+            elif command == b"SET":
+                expires = time.time() + int(args[4]) / 1000 if len(args) > 4 else None
+                store[args[1]] = (args[2], expires)
+                self.wfile.write(b"+OK\r\n")
+            elif command == b"DEL":
+                self.wfile.write(b":%d\r\n" % sum(store.pop(key, None) is not None for key in args[1:]))
+            elif command == b"SCAN":
+                # Everything in one page; MATCH only supports a trailing *
+                prefix = args[3][:-1]
+                keys = [key for key in store if key.startswith(prefix)]
+                self.wfile.write(b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys))
+                for key in keys:
+                    self.wfile.write(b"$%d\r\n%s\r\n" % (len(key), key))
+            else:
+                self.wfile.write(b"-ERR unknown command\r\n")
+
+
+@pytest.fixture
+def fake_redis():
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), FakeRedisHandler)
+    server.daemon_threads = True
+    server.store = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def token_cache(request, tmp_path):
+    from util.token_cache import make_token_cache
+
+    if request.param == "memory":
+        return make_token_cache("memory://")
+    if request.param == "sqlite":
+        return make_token_cache(f"sqlite://{tmp_path}/tokens.db")
+    server = request.getfixturevalue("fake_redis")
+    return make_token_cache("redis://127.0.0.1:%d/0" % server.server_address[1])
+
+
+def test_token_cache_round_trip(token_cache):
+    """Test that a cached token is returned without its refresh token."""
+    token_cache.set("uid", {"access_token": "a", "refresh_token": "r", "expired_ts": time.time() + 60})
+
+    token_info = token_cache.get("uid")
+
+    assert token_info["access_token"] == "a"
+    assert "refresh_token" not in token_info
+    assert token_cache.get("other") is None
+
+
+def test_token_cache_ignores_expired(token_cache):
+    """Test that expired tokens are not returned."""
+    token_cache.set("uid", {"access_token": "a", "expired_ts": time.time() - 1})
+
+    assert token_cache.get("uid") is None
+
+
+def test_token_cache_delete(token_cache):
+    """Test that deleted tokens are gone."""
+    token_cache.set("uid", {"access_token": "a", "expired_ts": time.time() + 60})
+    token_cache.delete("uid")
+
+    assert token_cache.get("uid") is None
+
+
+def test_token_cache_clear(token_cache):
+    """Test that every backend can be cleared."""
+    token_cache.set("uid", {"access_token": "a", "expired_ts": time.time() + 60})
+    token_cache.set("other", {"access_token": "b", "expired_ts": time.time() + 60})
+    token_cache.clear()
+
+    assert token_cache.get("uid") is None
+    assert token_cache.get("other") is None
+
+
+def test_sqlite_token_cache_corrupt_entry_is_a_miss(tmp_path):
+    """Test that an undecodable row is dropped and treated as a miss."""
+    from util.token_cache import make_token_cache
+
+    cache = make_token_cache(f"sqlite://{tmp_path}/tokens.db")
+    cache._conn.execute("INSERT INTO tokens VALUES ('uid', 'not json', ?)", (time.time() + 60,))
+
+    assert cache.get("uid") is None
+    assert cache._conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0] == 0
+
+
+def test_redis_token_cache_corrupt_entry_is_a_miss(fake_redis):
+    """Test that an undecodable value is deleted and treated as a miss."""
+    from util.token_cache import make_token_cache
+
+    cache = make_token_cache("redis://127.0.0.1:%d/0" % fake_redis.server_address[1])
+    fake_redis.store[b"token:uid"] = (b"not json", None)
+    fake_redis.store[b"token:partial"] = (b'{"access_token": "a"}', None)
+
+    assert cache.get("uid") is None
+    assert cache.get("partial") is None
+    assert fake_redis.store == {}
+
+
+def test_sqlite_token_cache_is_shared(tmp_path):
+    """Test that two caches on one file (two workers) see each other's writes."""
+    from util.token_cache import make_token_cache
+
+    url = f"sqlite://{tmp_path}/tokens.db"
+    make_token_cache(url).set("uid", {"access_token": "a", "expired_ts": time.time() + 60})
+
+    assert make_token_cache(url).get("uid")["access_token"] == "a"
+
+
+def test_redis_token_cache_unreachable_is_a_miss():
+    """Test that a down Redis server degrades to cache misses."""
+    from util.token_cache import RedisTokenCache
+
+    cache = RedisTokenCache(host="127.0.0.1", port=1, timeout=0.1)
+    cache.set("uid", {"access_token": "a", "expired_ts": time.time() + 60})
+
+    assert cache.get("uid") is None
+
+
+def test_make_token_cache_rejects_unknown_scheme():
+    """Test that an unsupported TOKEN_CACHE_URL raises ValueError."""
+    from util.token_cache import make_token_cache
+
+    with pytest.raises(ValueError):
+        make_token_cache("memcached://localhost")
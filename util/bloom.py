@@ -0,0 +1,73 @@
+import hashlib
+import math
+import threading
+from time import time
+
+
+class AgingBloomFilter:
+    """
+    Bloom filter whose members are forgotten after `ttl` to `2 * ttl` seconds.
+
+    Two generations are kept: adds go to the current one and lookups check
+    both. Every `ttl` seconds (or once the current generation holds
+    `capacity` members, to keep the false positive rate near `error_rate`)
+    the previous generation is dropped and a new one started. Memory is
+    fixed at about -capacity * ln(error_rate) / ln(2)^2 bits per generation.
+    """
+
+    def __init__(self, capacity, error_rate, ttl):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._lock = threading.Lock()
+        self._current = bytearray((self.num_bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+        self._rotated_at = time()
+        self.hits = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    @staticmethod
+    def _has(bits, positions):
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in positions)
+
+    def _maybe_rotate(self, now):
+        age = now - self._rotated_at
+        if age < self.ttl and self._count < self.capacity:
+            return
+        # Both generations are older than ttl when nothing rotated for 2 * ttl
+        self._previous = self._current if age < 2 * self.ttl else bytearray(len(self._current))
+        self._current = bytearray(len(self._previous))
+        self._count = 0
+        self._rotated_at = now
+
+    def add(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            self._maybe_rotate(time())
+            for p in positions:
+                self._current[p >> 3] |= 1 << (p & 7)
+            self._count += 1
+
+    def __contains__(self, key):
+        positions = self._positions(key)
+        with self._lock:
+            self._maybe_rotate(time())
+            found = self._has(self._current, positions) or self._has(self._previous, positions)
+        if found:
+            self.hits += 1
+        return found
+
+    def stats(self):
+        return {
+            "bits": self.num_bits,
+            "hashes": self.num_hashes,
+            "members": self._count,
+            "hits": self.hits,
+        }
@@ -0,0 +1,149 @@
+import threading
+from collections import OrderedDict
+from itertools import islice
+from time import time
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+
+    Callers pass the size of each value on put(); the least recently used
+    entries are evicted until the total fits in max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self._lock:
+            self._store(key, (value, size))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._remove(key)
+            if entry is None:
+                return default
+            return entry[0]
+
+    # Entries are tuples starting with (value, size); callers hold the lock
+
+    def _store(self, key, entry):
+        self._remove(key)
+        size = entry[1]
+        if size > self.max_bytes:
+            return
+        self._data[key] = entry
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._data.popitem(last=False)
+            self.total_bytes -= evicted[1]
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.total_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        return {
+            "entries": len(self._data),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries also expire `ttl` seconds after they are put.
+
+    With `max_stale`, expired entries are kept that much longer so lookup()
+    can still return them for stale-while-revalidate; get() only returns
+    fresh ones. Entries past that are dropped when read, and each put()
+    reclaims them from the least recently used end, so no full scan is needed.
+    """
+
+    # Expired entries checked from the LRU end on each put()
+    PURGE_BATCH = 8
+
+    def __init__(self, max_bytes, ttl, max_stale=0):
+        super().__init__(max_bytes)
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.expirations = 0
+        self.stale_hits = 0
+
+    def get(self, key, default=None, now=None):
+        found = self.lookup(key, now)
+        if found is None or not found[1]:
+            return default
+        return found[0]
+
+    def lookup(self, key, now=None):
+        """(value, is_fresh) for key, or None if missing or too stale."""
+        now = time() if now is None else now
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[2] <= now:
+                self._remove(key)
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            fresh = entry[3] > now
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale_hits += 1
+            return entry[0], fresh
+
+    def put(self, key, value, size, ttl=None, now=None):
+        now = time() if now is None else now
+        fresh_until = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._purge_expired(now)
+            self._store(key, (value, size, fresh_until + self.max_stale, fresh_until))
+
+    def _purge_expired(self, now):
+        expired = [key for key, entry in islice(self._data.items(), self.PURGE_BATCH) if entry[2] <= now]
+        for key in expired:
+            self._remove(key)
+        self.expirations += len(expired)
+
+    def stats(self):
+        stats = super().stats()
+        stats["expirations"] = self.expirations
+        stats["stale_hits"] = self.stale_hits
+        return stats
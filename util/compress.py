@@ -0,0 +1,43 @@
+import gzip
+import os
+
+from util.metrics import timed
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional, gzip is always available
+    brotli = None
+
+SVG_GZIP_LEVEL = int(os.getenv("SVG_GZIP_LEVEL", "9"))
+SVG_BROTLI_QUALITY = int(os.getenv("SVG_BROTLI_QUALITY", "9"))
+
+# Preferred first when the client accepts several
+ENCODINGS = ("br", "gzip")
+
+
+def compress_svg(svg):
+    """Encodings of an SVG body to store next to it, by Content-Encoding name."""
+    data = svg.encode("utf-8")
+    with timed("compress"):
+        encoded = {"gzip": gzip.compress(data, compresslevel=SVG_GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            encoded["br"] = brotli.compress(data, quality=SVG_BROTLI_QUALITY, mode=brotli.MODE_TEXT)
+    return encoded
+
+
+def pick_encoding(accept_encoding, encoded):
+    """Best stored encoding the Accept-Encoding header allows, or None for identity."""
+    accepted, refused = set(), set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            quality = float(params[2:]) if params.startswith("q=") else 1
+        except ValueError:
+            continue
+        (accepted if quality > 0 else refused).add(name.strip())
+
+    for name in ENCODINGS:
+        if name in encoded and name not in refused and (name in accepted or "*" in accepted):
+            return name
+    return None
@@ -0,0 +1,98 @@
+import io
+
+from PIL import Image, features
+
+MIME_TYPES = {
+    "png": "image/png",
+    "jpeg": "image/jpeg",
+    "webp": "image/webp",
+}
+
+# Quality range searched when encoding lossy covers to a byte budget
+MIN_QUALITY = 30
+MAX_QUALITY = 90
+
+
+def _save(img, fmt, quality=None):
+    buffered = io.BytesIO()
+    if fmt == "png":
+        img.save(buffered, format="PNG", optimize=True)
+    elif fmt == "jpeg":
+        img.save(buffered, format="JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffered, format="WEBP", quality=quality, method=4)
+    return buffered.getvalue()
+
+
+def encode_cover(img, fmt="jpeg", max_bytes=None):
+    """
+    Encode a resized cover, returning (data, mime_type).
+
+    Lossy formats binary-search the highest quality that fits in max_bytes
+    (falling back to the lowest quality if nothing fits). WebP falls back to
+    JPEG when Pillow was built without it.
+    """
+    if fmt == "webp" and not features.check("webp"):
+        fmt = "jpeg"
+    if fmt not in MIME_TYPES:
+        raise ValueError(f"Unsupported cover format: {fmt}")
+
+    if fmt == "png":
+        return _save(img, fmt), MIME_TYPES[fmt]
+
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    if not max_bytes:
+        return _save(img, fmt, MAX_QUALITY), MIME_TYPES[fmt]
+
+    low, high = MIN_QUALITY, MAX_QUALITY
+    best = None
+    while low <= high:
+        quality = (low + high) // 2
+        data = _save(img, fmt, quality)
+        if len(data) <= max_bytes:
+            best = data
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    if best is None:
+        best = _save(img, fmt, MIN_QUALITY)
+    return best, MIME_TYPES[fmt]
+
+
+def select_image_variant(images, target_size):
+    """
+    Pick the smallest Spotify image variant at least target_size wide.
+
+    Falls back to the largest variant when none is big enough. Variants
+    without dimensions are treated as larger than any sized one.
+    """
+    images = [image for image in images or [] if image.get("url")]
+    if not images:
+        return None
+
+    def width(image):
+        return image.get("width") or image.get("height") or float("inf")
+
+    large_enough = [image for image in images if width(image) >= target_size]
+    if large_enough:
+        return min(large_enough, key=width)
+    return max(images, key=width)
+
+
+def decode_cover(data, target_size):
+    """
+    Open a downloaded cover, letting JPEG decode at a reduced scale.
+
+    draft() makes libjpeg decode at the smallest 1/2, 1/4 or 1/8 scale that
+    is still at least target_size, which is much cheaper than a full decode
+    followed by a downsample. The pixels are loaded here rather than on
+    first use, so the decode is not counted against later stages.
+    """
+    img = Image.open(io.BytesIO(data))
+    if img.format == "JPEG":
+        img.draft("RGB", (target_size, target_size))
+    img.load()
+    return img
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows; eviction is then only per process
+    fcntl = None
+
+
+class DiskStore:
+    """
+    Content-addressed blob store on local disk, shared by every worker on a node.
+
+    Each key is stored at root/<sha256[:2]>/<sha256> and written through a
+    temporary file plus os.replace, so readers in other processes never see a
+    partial blob. Reads bump the file's mtime, which eviction uses as its LRU
+    clock.
+
+    The store size is tracked approximately: the total found by the last
+    eviction scan plus the bytes this process has written since. Once that
+    passes max_bytes, eviction runs on a background thread, at most every
+    `evict_interval` seconds per process and in one process at a time
+    (guarded by a lock file), so puts never walk the store.
+    """
+
+    def __init__(self, root, max_bytes, evict_interval=5):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.evict_interval = evict_interval
+        self._lock = threading.Lock()
+        # None until the first scan has measured the store
+        self._scanned = None
+        self._pending = 0
+        self._next_evict = 0
+        self._evict_thread = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.root, digest[:2], digest)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted since we read it; the data is still good
+            pass
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+        self._maybe_evict(len(data))
+
+    def _maybe_evict(self, size):
+        with self._lock:
+            self._pending += size
+            over = self._scanned is None or self._scanned + self._pending > self.max_bytes
+            now = time.monotonic()
+            if not over or now < self._next_evict or self._evict_thread is not None:
+                return
+            self._next_evict = now + self.evict_interval
+            self._evict_thread = threading.Thread(target=self._evict_in_background, name="disk-store-evict", daemon=True)
+        self._evict_thread.start()
+
+    def _evict_in_background(self):
+        try:
+            with open(os.path.join(self.root, ".evict.lock"), "a") as lock:
+                if fcntl is not None:
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    except BlockingIOError:
+                        # Another worker is evicting; try again after evict_interval
+                        return
+                self.evict()
+        except OSError as e:
+            print(f"Error evicting disk store: {e}")
+        finally:
+            with self._lock:
+                self._evict_thread = None
+
+    def _entries(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, name, stat
+
+    def evict(self):
+        """Delete least recently used blobs until the store fits in max_bytes."""
+        with self._lock:
+            # Writes made during the scan are counted on top of its result
+            pending = self._pending
+
+        entries = []
+        total = 0
+        stale_tmp = time.time() - 60
+        for path, name, stat in self._entries():
+            if name == ".evict.lock":
+                continue
+            # Leftovers of writers that died mid-write
+            if name.startswith(".tmp-"):
+                if stat.st_mtime < stale_tmp:
+                    self._unlink(path)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._unlink(path)
+            total -= size
+
+        with self._lock:
+            self._scanned = total
+            self._pending -= pending
+        return total
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
@@ -12,6 +12,11 @@ def get_firestore_db():
     if os.getenv("TESTING") == "true":
         from unittest.mock import MagicMock
         return MagicMock()
+
+    # Local Firestore emulator (`gcloud emulators firestore start`); needs no credentials
+    if os.getenv("FIRESTORE_EMULATOR_HOST"):
+        from google.cloud import firestore as cloud_firestore
+        return cloud_firestore.Client(project=os.getenv("FIRESTORE_PROJECT_ID", "demo-spotify-github-profile"))
     
     if not firebase_admin._apps:
         firebase_config = os.getenv("FIREBASE")
@@ -0,0 +1,87 @@
+import os
+import uuid
+from time import time
+
+from google.cloud import firestore
+
+
+class FirestoreLease:
+    """
+    Short-lived per-document lease, so only one worker refreshes a token.
+
+    The lease is a `{"owner", "until"}` map stored in `field` on the document
+    itself and taken inside a Firestore transaction: if two workers race, one
+    of the transactions is retried, sees the other's lease and backs off.
+    An expired lease (crashed holder) can be taken over. Only standard
+    transactions are used, so this also runs against the Firestore emulator.
+    """
+
+    def __init__(self, db, ttl=10, field="refresh_lease", owner=None):
+        self.db = db
+        self.ttl = ttl
+        self.field = field
+        self.owner = owner or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.acquired = 0
+        self.contended = 0
+
+    def acquire(self, doc_ref, skip_if=None):
+        """
+        Take the lease on doc_ref. Returns (acquired, data), where data is the
+        document as read inside the transaction (None if it does not exist).
+
+        No lease is taken while another owner holds one, or when skip_if(data)
+        says the work is already done (e.g. another worker just refreshed).
+        """
+        acquired, data = _take_lease(self.db.transaction(), doc_ref, self.field, self.owner, self.ttl, skip_if)
+        if acquired:
+            self.acquired += 1
+        elif data is not None and not (skip_if and skip_if(data)):
+            self.contended += 1
+        return acquired, data
+
+    def release(self, doc_ref):
+        """Drop the lease early if we still hold it; another owner's lease is left alone."""
+        try:
+            _drop_lease(self.db.transaction(), doc_ref, self.field, self.owner)
+        except Exception as e:
+            print(f"Error releasing refresh lease: {e}")
+
+    def releasing(self, fields):
+        """Fields for an update() that also drops the lease held by this worker."""
+        return {**fields, self.field: firestore.DELETE_FIELD}
+
+    def stats(self):
+        return {"acquired": self.acquired, "contended": self.contended}
+
+
+@firestore.transactional
+def _take_lease(transaction, doc_ref, field, owner, ttl, skip_if=None):
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False, None
+
+    data = snapshot.to_dict() or {}
+    if skip_if is not None and skip_if(data):
+        return False, data
+
+    now = time()
+    lease = data.get(field)
+    if lease and lease["until"] > now and lease["owner"] != owner:
+        return False, data
+
+    transaction.update(doc_ref, {field: {"owner": owner, "until": now + ttl}})
+    return True, data
+
+
+@firestore.transactional
+def _drop_lease(transaction, doc_ref, field, owner):
+    snapshot = doc_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return False
+
+    lease = (snapshot.to_dict() or {}).get(field)
+    if not lease or lease["owner"] != owner:
+        return False
+
+    transaction.update(doc_ref, {field: firestore.DELETE_FIELD})
+    return True
@@ -0,0 +1,132 @@
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter per label values."""
+
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _labels(self.labels, values), value) for values, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative histogram per label values, in the Prometheus layout."""
+
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> [per-bucket counts (+Inf last), sum]
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts, total = self._values.get(label_values) or ([0] * (len(self.buckets) + 1), 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[label_values] = (counts, total + value)
+
+    def count(self, *label_values):
+        entry = self._values.get(label_values)
+        return sum(entry[0]) if entry else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for values, (counts, total) in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    le = _labels(self.labels + ("le",), values + (bound,))
+                    samples.append((f"{self.name}_bucket", le, cumulative))
+                samples.append((f"{self.name}_sum", _labels(self.labels, values), total))
+                samples.append((f"{self.name}_count", _labels(self.labels, values), cumulative))
+        return samples
+
+
+STAGE_SECONDS = Histogram(
+    "spotify_profile_stage_seconds",
+    "Time spent in each stage of building a card.",
+    labels=("stage",),
+)
+UPSTREAM_RESPONSES = Counter(
+    "spotify_profile_upstream_responses_total",
+    "Responses from Spotify by endpoint and status code (rate_limited / error when none came back).",
+    labels=("endpoint", "status"),
+)
+METRICS = [STAGE_SECONDS, UPSTREAM_RESPONSES]
+
+
+@contextmanager
+def timed(stage):
+    """Record the time spent in the block under STAGE_SECONDS{stage=...}."""
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(perf_counter() - start, stage)
+
+
+def render(metrics=METRICS, extra=()):
+    """
+    Prometheus text exposition of `metrics` plus `extra` samples.
+
+    `extra` is an iterable of (name, type, help, labels_dict, value), for
+    values read from other components' stats() at scrape time.
+    """
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+
+    # Samples of one metric must be contiguous, so group extras by name
+    families = {}
+    for name, metric_type, help, labels, value in extra:
+        family = families.setdefault(name, (metric_type, help, []))
+        family[2].append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    for name, (metric_type, help, samples) in families.items():
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,86 @@
+import time
+
+import numpy as np
+from PIL import Image
+
+# Side of the thumbnail the palette is computed on
+PALETTE_THUMBNAIL_SIZE = 100
+TOP_TWO_BITS = 0b11000000
+
+
+class PaletteTimeout(Exception):
+    pass
+
+
+def _hsl_h_l(r, g, b):
+    """Vectorized integer hue and lightness, matching colorgram.hsl."""
+    most = np.maximum(np.maximum(r, g), b)
+    least = np.minimum(np.minimum(r, g), b)
+    lightness = (most + least) >> 1
+
+    diff = most - least
+    safe_diff = np.where(diff == 0, 1, diff)
+    hue = np.where(
+        most == r,
+        (g - b) * 255 // safe_diff + np.where(g < b, 1530, 0),
+        np.where(
+            most == g,
+            (b - r) * 255 // safe_diff + 510,
+            (r - g) * 255 // safe_diff + 1020,
+        ),
+    ) // 6
+    hue = np.where(diff == 0, 0, hue)
+    return hue, lightness
+
+
+def _extract_numpy(image, number_of_colors):
+    pixels = np.asarray(image, dtype=np.int64).reshape(-1, 3)
+    r, g, b = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+
+    # Same 12-bit bucket colorgram packs each pixel into: top two bits of
+    # luminance, hue and lightness (its RGB bits are unused upstream too)
+    hue, lightness = _hsl_h_l(r, g, b)
+    luminance = (r * 0.2126 + g * 0.7152 + b * 0.0722).astype(np.int64)
+    packed = (
+        ((luminance & TOP_TWO_BITS) << 4)
+        | ((hue & TOP_TWO_BITS) << 2)
+        | (lightness & TOP_TWO_BITS)
+    )
+
+    counts = np.bincount(packed, minlength=4096)
+    sums = [np.bincount(packed, weights=channel, minlength=4096) for channel in (r, g, b)]
+
+    used = np.nonzero(counts)[0]
+    # Most used buckets first, ties broken by bucket index like colorgram's stable sort
+    order = used[np.lexsort((used, -counts[used]))][:number_of_colors]
+    return [
+        tuple(int(channel[index]) // int(counts[index]) for channel in sums)
+        for index in order
+    ]
+
+
+def extract_palette(image, number_of_colors=10, thumbnail_size=PALETTE_THUMBNAIL_SIZE, time_budget=None, started=None):
+    """
+    Return the most used colours of a decoded PIL image as (r, g, b) tuples.
+
+    Uses colorgram's bucketing, vectorized with NumPy, on a nearest-neighbour
+    thumbnail (resampling filters blend colours across buckets).
+
+    time_budget (seconds) counts from `started` (a perf_counter() value,
+    e.g. taken before the cover was decoded) or from the call. It is
+    checked before each step, so once it is used up the remaining work is
+    skipped with PaletteTimeout; a palette once computed is returned.
+    """
+    if started is None:
+        started = time.perf_counter()
+
+    def check_budget():
+        if time_budget is not None and time.perf_counter() - started > time_budget:
+            raise PaletteTimeout
+
+    check_budget()
+    thumbnail = image.convert("RGB")
+    thumbnail.thumbnail((thumbnail_size, thumbnail_size), Image.NEAREST)
+
+    check_budget()
+    return _extract_numpy(thumbnail, number_of_colors)
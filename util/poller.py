@@ -0,0 +1,111 @@
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, wait
+from time import time
+
+
+class HotSetPoller:
+    """
+    Re-renders the cards of the most viewed uids before their cache entries expire.
+
+    touch() records a request for a uid and one of its render variants. A
+    daemon thread wakes every `interval` seconds, picks up to `budget` uids
+    viewed within `active_window` (most viewed first) and calls
+    poll(uid, variants) for each, where variants are the uid's `max_variants`
+    most requested (key, params) pairs. View counts are halved every cycle,
+    so the hot set follows current traffic. Upstream calls are bounded by
+    the budget, not by how often the cards are viewed.
+    """
+
+    def __init__(self, poll, interval=25, budget=50, max_concurrency=4,
+                 active_window=600, max_variants=3):
+        self.poll = poll
+        self.interval = interval
+        self.budget = budget
+        self.active_window = active_window
+        self.max_variants = max_variants
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="hot-set-poll")
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._views = Counter()
+        # uid -> Counter of variant key, and key -> params
+        self._variant_views = {}
+        self._variant_params = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.polled = 0
+        self.failed = 0
+
+    def touch(self, uid, key, params):
+        with self._lock:
+            self._last_seen[uid] = time()
+            self._views[uid] += 1
+            self._variant_views.setdefault(uid, Counter())[key] += 1
+            self._variant_params[key] = params
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="hot-set-poller", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll_hot_set()
+            except Exception as e:
+                print(f"Hot set poller error: {e}")
+
+    def hot_set(self, now=None):
+        """[(uid, [(key, params), ...])] to poll this cycle, most viewed first."""
+        now = now or time()
+        with self._lock:
+            for uid, last_seen in list(self._last_seen.items()):
+                if now - last_seen > self.active_window:
+                    self._forget(uid)
+
+            hot = []
+            for uid, _ in self._views.most_common(self.budget):
+                keys = [key for key, _ in self._variant_views[uid].most_common(self.max_variants)]
+                hot.append((uid, [(key, self._variant_params[key]) for key in keys]))
+
+            # Decay, dropping variants nobody asks for any more
+            for uid, variants in self._variant_views.items():
+                for key in list(variants):
+                    variants[key] //= 2
+                    if not variants[key] and len(variants) > self.max_variants:
+                        del variants[key]
+                        self._variant_params.pop(key, None)
+                self._views[uid] = max(1, self._views[uid] // 2)
+            return hot
+
+    def poll_hot_set(self):
+        futures = [self._executor.submit(self._poll, uid, variants) for uid, variants in self.hot_set()]
+        wait(futures)
+
+    def _poll(self, uid, variants):
+        try:
+            self.poll(uid, variants)
+            self.polled += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Hot set poll failed for {uid}: {e}")
+
+    def _forget(self, uid):
+        self._last_seen.pop(uid, None)
+        self._views.pop(uid, None)
+        for key in self._variant_views.pop(uid, ()):
+            self._variant_params.pop(key, None)
+
+    def stats(self):
+        return {
+            "tracked": len(self._last_seen),
+            "polled": self.polled,
+            "failed": self.failed,
+        }
@@ -0,0 +1,113 @@
+import threading
+from time import monotonic, sleep
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, up to `burst` saved up.
+
+    acquire() waits up to `timeout` seconds for a token and returns False if
+    none became available, so callers can give up instead of queueing.
+    """
+
+    def __init__(self, rate, burst):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive, got {rate}")
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+        self.throttled = 0
+
+    def _take(self):
+        """Take a token, or return how long until one is available."""
+        with self._lock:
+            now = monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self, timeout=0):
+        deadline = monotonic() + timeout
+        while True:
+            wait = self._take()
+            if wait == 0:
+                return True
+            if monotonic() + wait > deadline:
+                self.throttled += 1
+                return False
+            sleep(wait)
+
+
+class CircuitBreaker:
+    """
+    Stops calls to an upstream that is failing or has asked us to back off.
+
+    The breaker opens after `failure_threshold` consecutive failures for
+    `reset_timeout` seconds, or for as long as a Retry-After asked via
+    open_for(). Once that has passed a single probe call is let through:
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until = 0
+        self._probing = False
+        self.opened = 0
+        self.rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if not self._open_until:
+                return True
+            if monotonic() >= self._open_until and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_after(self):
+        """Seconds until the next call may be let through (0 when closed)."""
+        return max(0, self._open_until - monotonic()) if self._open_until else 0
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._open_until = 0
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._open(self.reset_timeout)
+
+    def abandon(self):
+        """The call allow() let through was never made; let another probe in."""
+        with self._lock:
+            self._probing = False
+
+    def open_for(self, seconds):
+        with self._lock:
+            self._open(seconds)
+
+    def _open(self, seconds):
+        self._open_until = max(self._open_until, monotonic() + seconds)
+        self._probing = False
+        self.opened += 1
+
+    @property
+    def state(self):
+        if not self._open_until:
+            return "closed"
+        return "half-open" if monotonic() >= self._open_until else "open"
+
+    def stats(self):
+        return {"state": self.state, "opened": self.opened, "rejected": self.rejected}
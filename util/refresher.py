@@ -0,0 +1,116 @@
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+# refresh(uid) result when another worker holds the refresh; retried next cycle
+SKIPPED = "skipped"
+
+
+class TokenRefresher:
+    """
+    Refreshes access tokens of recently viewed uids before they expire.
+
+    touch() records a view. A daemon thread wakes every `interval` seconds
+    and, for each uid viewed within `active_window`, calls refresh(uid) once
+    its token is within `lead_time` (+ a stable per-uid jitter) of expiry.
+    At most `max_concurrency` refreshes run at once. refresh(uid) returning
+    False stops tracking the uid (e.g. it has no token any more); returning
+    SKIPPED counts the run as skipped, not refreshed.
+    """
+
+    def __init__(self, refresh, get_expiry, lead_time=300, jitter=120,
+                 max_concurrency=4, active_window=3600, interval=15):
+        self.refresh = refresh
+        self.get_expiry = get_expiry
+        self.lead_time = lead_time
+        self.jitter = jitter
+        self.active_window = active_window
+        self.interval = interval
+        self._executor = ThreadPoolExecutor(max_concurrency, thread_name_prefix="token-refresh")
+        self._lock = threading.Lock()
+        self._last_seen = {}
+        self._in_flight = set()
+        self._jitter = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self.refreshed = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def touch(self, uid):
+        self._last_seen[uid] = time()
+        if self._thread is None:
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.schedule_due()
+            except Exception as e:
+                print(f"Token refresher error: {e}")
+
+    def due(self, now=None):
+        """uids that were viewed recently and whose token is about to expire."""
+        now = now or time()
+        due = []
+        for uid, last_seen in list(self._last_seen.items()):
+            if now - last_seen > self.active_window:
+                self._forget(uid)
+                continue
+            if uid in self._in_flight:
+                continue
+            if uid not in self._jitter:
+                self._jitter[uid] = random.uniform(0, self.jitter)
+            expired_ts = self.get_expiry(uid)
+            if expired_ts is None or expired_ts - now <= self.lead_time + self._jitter[uid]:
+                due.append(uid)
+        return due
+
+    def schedule_due(self):
+        for uid in self.due():
+            with self._lock:
+                if uid in self._in_flight:
+                    continue
+                self._in_flight.add(uid)
+            self._executor.submit(self._refresh, uid)
+
+    def _refresh(self, uid):
+        try:
+            result = self.refresh(uid)
+            if result is False:
+                self._forget(uid)
+            elif result == SKIPPED:
+                self.skipped += 1
+            else:
+                self.refreshed += 1
+        except Exception as e:
+            self.failed += 1
+            self._forget(uid)
+            print(f"Background refresh failed for {uid}: {e}")
+        finally:
+            with self._lock:
+                self._in_flight.discard(uid)
+
+    def _forget(self, uid):
+        self._last_seen.pop(uid, None)
+        self._jitter.pop(uid, None)
+
+    def stats(self):
+        return {
+            "tracked": len(self._last_seen),
+            "in_flight": len(self._in_flight),
+            "refreshed": self.refreshed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
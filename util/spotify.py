@@ -2,6 +2,9 @@ import os
 import json
 import requests
 from base64 import b64encode
+from requests.adapters import HTTPAdapter
+from util.ratelimit import TokenBucket, CircuitBreaker
+from util.metrics import UPSTREAM_RESPONSES, timed
 from dotenv import load_dotenv, find_dotenv
 
 load_dotenv(find_dotenv())
@@ -18,9 +21,153 @@ SPOTIFY_URL_NOW_PLAYING = "https://api.spotify.com/v1/me/player/currently-playin
 SPOTIFY_URL_RECENTLY_PLAY = "https://api.spotify.com/v1/me/player/recently-played?limit=10"
 SPOTIFY_URL_USER_INFO = "https://api.spotify.com/v1/me"
 
+# Connection pool sizing, per gunicorn worker. POOL_MAXSIZE is the number of
+# keep-alive sockets kept open to each host.
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "10"))
+
+# (connect, read) timeouts in seconds, per endpoint
+HTTP_TIMEOUTS = {
+    "token": (
+        float(os.getenv("HTTP_TOKEN_CONNECT_TIMEOUT", "3.05")),
+        float(os.getenv("HTTP_TOKEN_READ_TIMEOUT", "10")),
+    ),
+    "api": (
+        float(os.getenv("HTTP_API_CONNECT_TIMEOUT", "3.05")),
+        float(os.getenv("HTTP_API_READ_TIMEOUT", "5")),
+    ),
+    "image": (
+        float(os.getenv("HTTP_IMAGE_CONNECT_TIMEOUT", "3.05")),
+        float(os.getenv("HTTP_IMAGE_READ_TIMEOUT", "10")),
+    ),
+}
+
+# Hosts that get a dedicated pool; anything else falls back to the default adapter
+POOLED_HOSTS = [
+    "https://accounts.spotify.com",
+    "https://api.spotify.com",
+    "https://i.scdn.co",
+]
+
+# Governor for api.spotify.com calls, per worker: a token bucket sized to
+# our share of the app's quota, and a circuit breaker that honours
+# Retry-After on 429 and backs off after repeated 5xx / network errors.
+# SPOTIFY_RATE_LIMIT=0 turns the token bucket off (the breaker stays on)
+SPOTIFY_RATE_LIMIT = float(os.getenv("SPOTIFY_RATE_LIMIT", "20"))
+SPOTIFY_RATE_BURST = int(os.getenv("SPOTIFY_RATE_BURST", "40"))
+# How long a call may wait for a token before giving up
+SPOTIFY_RATE_WAIT = float(os.getenv("SPOTIFY_RATE_WAIT", "0.5"))
+SPOTIFY_BREAKER_FAILURES = int(os.getenv("SPOTIFY_BREAKER_FAILURES", "5"))
+SPOTIFY_BREAKER_RESET = float(os.getenv("SPOTIFY_BREAKER_RESET", "30"))
+
 class InvalidTokenError(Exception):
     pass
 
+
+class RateLimitedError(Exception):
+    """The call was not made (or got a 429); retry after `retry_after` seconds."""
+
+    def __init__(self, retry_after=0):
+        super().__init__(f"Spotify rate limited, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class SpotifyClient:
+    """
+    Keep-alive HTTP client with one connection pool per upstream host.
+
+    The underlying session is created lazily and recreated after a fork, so
+    sockets are never shared between gunicorn workers. Calls to the "api"
+    endpoint go through the rate limit governor and raise RateLimitedError
+    instead of reaching Spotify while it is throttling us.
+    """
+
+    def __init__(self, pool_connections=None, pool_maxsize=None, timeouts=None,
+                 bucket=None, breaker=None):
+        self.pool_connections = pool_connections or HTTP_POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or HTTP_POOL_MAXSIZE
+        self.timeouts = dict(HTTP_TIMEOUTS, **(timeouts or {}))
+        if bucket is None and SPOTIFY_RATE_LIMIT > 0:
+            bucket = TokenBucket(SPOTIFY_RATE_LIMIT, SPOTIFY_RATE_BURST)
+        self.bucket = bucket
+        self.breaker = breaker or CircuitBreaker(SPOTIFY_BREAKER_FAILURES, SPOTIFY_BREAKER_RESET)
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            self._session = self._make_session()
+            self._pid = os.getpid()
+        return self._session
+
+    def _make_session(self):
+        session = requests.Session()
+        for prefix in POOLED_HOSTS + ["https://", "http://"]:
+            session.mount(prefix, HTTPAdapter(
+                pool_connections=self.pool_connections,
+                pool_maxsize=self.pool_maxsize,
+            ))
+        return session
+
+    def request(self, method, url, endpoint="api", **kwargs):
+        kwargs.setdefault("timeout", self.timeouts[endpoint])
+        if endpoint != "api":
+            return self._send(method, url, endpoint, **kwargs)
+
+        if not self.breaker.allow():
+            UPSTREAM_RESPONSES.inc(endpoint, "rate_limited")
+            raise RateLimitedError(self.breaker.retry_after())
+        if self.bucket is not None and not self.bucket.acquire(SPOTIFY_RATE_WAIT):
+            self.breaker.abandon()
+            UPSTREAM_RESPONSES.inc(endpoint, "rate_limited")
+            raise RateLimitedError(1 / self.bucket.rate)
+
+        try:
+            res = self._send(method, url, endpoint, **kwargs)
+        except requests.exceptions.RequestException:
+            self.breaker.record_failure()
+            raise
+
+        if res.status_code == 429:
+            retry_after = _retry_after(res)
+            self.breaker.open_for(retry_after)
+            raise RateLimitedError(retry_after)
+        if res.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return res
+
+    def _send(self, method, url, endpoint, **kwargs):
+        try:
+            res = self.session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            UPSTREAM_RESPONSES.inc(endpoint, "error")
+            raise
+        UPSTREAM_RESPONSES.inc(endpoint, str(res.status_code))
+        return res
+
+    def get(self, url, endpoint="api", **kwargs):
+        return self.request("GET", url, endpoint=endpoint, **kwargs)
+
+    def post(self, url, endpoint="api", **kwargs):
+        return self.request("POST", url, endpoint=endpoint, **kwargs)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+
+def _retry_after(res, default=SPOTIFY_BREAKER_RESET):
+    try:
+        return max(1.0, float(res.headers.get("Retry-After", default)))
+    except ValueError:
+        return default
+
+client = SpotifyClient()
+
 def _auth_header():
     # Helper for client credential auth
     auth_str = f'{SPOTIFY_CLIENT_ID}:{SPOTIFY_SECRET_ID}'
@@ -32,22 +179,35 @@ def generate_token(code):
         "code": code,
         "redirect_uri": REDIRECT_URI,
     }
-    res = requests.post(SPOTIFY_URL_TOKEN, data=data, headers=_auth_header())
+    res = client.post(SPOTIFY_URL_TOKEN, endpoint="token", data=data, headers=_auth_header())
     return res.json()
 
 def refresh_token(refresh_token):
     data = {"grant_type": "refresh_token", "refresh_token": refresh_token}
-    res = requests.post(SPOTIFY_URL_TOKEN, data=data, headers=_auth_header())
-    return res.json()
+    with timed("refresh"):
+        res = client.post(SPOTIFY_URL_TOKEN, endpoint="token", data=data, headers=_auth_header())
+        return res.json()
 
 def get_user_profile(access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
-    return requests.get(SPOTIFY_URL_USER_INFO, headers=headers).json()
+    return client.get(SPOTIFY_URL_USER_INFO, headers=headers).json()
 
 def get_now_playing(access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
-    return requests.get(SPOTIFY_URL_NOW_PLAYING, headers=headers).json()
+    with timed("now_playing"):
+        res = client.get(SPOTIFY_URL_NOW_PLAYING, headers=headers)
+        # 204 No Content means nothing is playing
+        if res.status_code == 204:
+            return {"is_playing": False}
+        return res.json()
 
 def get_recently_play(access_token):
     headers = {"Authorization": f"Bearer {access_token}"}
-    return requests.get(SPOTIFY_URL_RECENTLY_PLAY, headers=headers).json()
\ No newline at end of file
+    with timed("recently_played"):
+        return client.get(SPOTIFY_URL_RECENTLY_PLAY, headers=headers).json()
+
+def get_image(url):
+    with timed("image_download"):
+        res = client.get(url, endpoint="image")
+        res.raise_for_status()
+        return res.content
@@ -0,0 +1,74 @@
+import re
+
+from util.cache import LRUCache
+
+# Template variables that change per track and are spliced in per request.
+# Everything else a theme is rendered with is treated as part of its layout.
+DYNAMIC_SLOTS = ("artist_name", "song_name", "img", "img_mime", "bar_color", "placeholder_duration")
+
+_SLOT_PATTERN = re.compile("\x1e[a-z]+:([a-z_]+)\x1f")
+# Two sentinel sets of different lengths, so templates that compute
+# something from a dynamic value (e.g. song_name|length) can be detected
+_SENTINEL_TAGS = ("a", "bbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbbb")
+
+_NOT_SPLITTABLE = ()
+_SENTINEL_CHARS = str.maketrans("", "", "\x1e\x1f")
+
+
+class ThemeRenderer:
+    """
+    Renders card templates from pre-rendered static segments.
+
+    The first time a template is used with a given set of layout variables
+    (theme, colours, cover/playing flags, ...) it is rendered once with
+    sentinel strings in place of the dynamic slots and split around them.
+    Later renders only join those segments with the escaped dynamic values.
+    Templates whose output depends on a dynamic value beyond inserting it
+    fall back to a normal Jinja render. Layout values come from the query
+    string, so the sentinel delimiters are stripped from them first.
+    """
+
+    def __init__(self, jinja_env, max_bytes=8 * 1024 * 1024):
+        self.jinja_env = jinja_env
+        self._compiled = LRUCache(max_bytes)
+
+    def _split(self, template, layout, dynamic, tag):
+        context = dict(layout)
+        for slot in DYNAMIC_SLOTS:
+            # Falsy values are part of the layout key, so they render as-is
+            context[slot] = f"\x1e{tag}:{slot}\x1f" if dynamic[slot] else dynamic[slot]
+        return _SLOT_PATTERN.split(template.render(**context))
+
+    def compile(self, template_name, layout, dynamic):
+        template = self.jinja_env.get_template(template_name)
+        first, second = (self._split(template, layout, dynamic, tag) for tag in _SENTINEL_TAGS)
+        if first != second or any(slot not in DYNAMIC_SLOTS for slot in first[1::2]):
+            return _NOT_SPLITTABLE
+        return tuple(first)
+
+    def render(self, template_name, layout, dynamic):
+        layout = {
+            name: value.translate(_SENTINEL_CHARS) if isinstance(value, str) else value
+            for name, value in layout.items()
+        }
+        key = (
+            template_name,
+            tuple(sorted(layout.items())),
+            tuple(bool(dynamic[slot]) for slot in DYNAMIC_SLOTS),
+        )
+        segments = self._compiled.get(key)
+        if segments is None:
+            segments = self.compile(template_name, layout, dynamic)
+            self._compiled.put(key, segments, sum(len(segment) for segment in segments) + 64)
+
+        if segments is _NOT_SPLITTABLE:
+            return self.jinja_env.get_template(template_name).render(**layout, **dynamic)
+
+        # Segments alternate static text and slot names
+        return "".join(
+            segment if i % 2 == 0 else str(dynamic[segment])
+            for i, segment in enumerate(segments)
+        )
+
+    def stats(self):
+        return self._compiled.stats()
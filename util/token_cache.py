@@ -0,0 +1,267 @@
+"""
+Access token caches shared by the view, callback and app workers.
+
+Only the access token and its expiry are cached, never the refresh token.
+The backend is picked by TOKEN_CACHE_URL:
+
+    memory://                      per-process dict (the old behaviour)
+    sqlite:///dev/shm/tokens.db    SQLite file shared by every worker on a
+                                   node; under /dev/shm it lives in memory
+    redis://host:6379/0            any server speaking the Redis protocol
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+from time import time
+from urllib.parse import urlsplit, unquote
+
+TOKEN_CACHE_URL = os.getenv("TOKEN_CACHE_URL", "memory://")
+
+
+def _cached_fields(token_info):
+    return {
+        "access_token": token_info["access_token"],
+        "expired_ts": token_info["expired_ts"],
+    }
+
+
+def _decode(data):
+    """Cached token info, or None for a corrupt entry (treated as a miss)."""
+    try:
+        token_info = json.loads(data)
+        token_info["access_token"], token_info["expired_ts"]
+    except (ValueError, TypeError, KeyError) as e:
+        print(f"Token cache entry is corrupt: {e!r}")
+        return None
+    return token_info
+
+
+class MemoryTokenCache:
+    # Entries written by other processes (callback, app) are not seen here
+    shared = False
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+
+    def get(self, uid):
+        token_info = self._data.get(uid)
+        if token_info is None or token_info["expired_ts"] <= time():
+            return None
+        return token_info
+
+    def set(self, uid, token_info):
+        with self._lock:
+            self._data[uid] = _cached_fields(token_info)
+
+    def delete(self, uid):
+        with self._lock:
+            self._data.pop(uid, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class SQLiteTokenCache:
+    """Token cache in a local SQLite file, one connection per thread."""
+
+    PURGE_EVERY = 256
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._sets = 0
+
+    @property
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS tokens "
+                "(uid TEXT PRIMARY KEY, token_info TEXT NOT NULL, expired_ts REAL NOT NULL)"
+            )
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, uid):
+        try:
+            row = self._conn.execute(
+                "SELECT token_info FROM tokens WHERE uid = ? AND expired_ts > ?", (uid, time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            print(f"Token cache read failed: {e}")
+            return None
+        if not row:
+            return None
+        token_info = _decode(row[0])
+        if token_info is None:
+            self.delete(uid)
+        return token_info
+
+    def set(self, uid, token_info):
+        token_info = _cached_fields(token_info)
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tokens (uid, token_info, expired_ts) VALUES (?, ?, ?)",
+                (uid, json.dumps(token_info), token_info["expired_ts"]),
+            )
+            self._sets += 1
+            if self._sets % self.PURGE_EVERY == 0:
+                self._conn.execute("DELETE FROM tokens WHERE expired_ts <= ?", (time(),))
+        except sqlite3.Error as e:
+            print(f"Token cache write failed: {e}")
+
+    def delete(self, uid):
+        try:
+            self._conn.execute("DELETE FROM tokens WHERE uid = ?", (uid,))
+        except sqlite3.Error as e:
+            print(f"Token cache delete failed: {e}")
+
+    def clear(self):
+        self._conn.execute("DELETE FROM tokens")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisTokenCache:
+    """
+    Token cache on a Redis-protocol server, using a minimal RESP client.
+
+    Entries expire server-side with the token (SET ... PX). Any connection
+    or protocol failure is treated as a cache miss.
+    """
+
+    shared = True
+
+    def __init__(self, host="localhost", port=6379, db=0, password=None, timeout=0.5, prefix="token:"):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self.prefix = prefix
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.sock = sock
+        self._local.reader = sock.makefile("rb")
+        self._local.pid = os.getpid()
+        if self.password:
+            self._command("AUTH", self.password)
+        if self.db:
+            self._command("SELECT", self.db)
+
+    def _close(self):
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode()
+        if kind == b"-":
+            raise RedisError(payload.decode())
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._local.reader.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+        raise RedisError(f"Unknown reply type: {line!r}")
+
+    def _command(self, *args):
+        if getattr(self._local, "sock", None) is None or self._local.pid != os.getpid():
+            self._connect()
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            arg = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        self._local.sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _safe_command(self, *args):
+        try:
+            return self._command(*args)
+        except (OSError, RedisError) as e:
+            print(f"Token cache command {args[0]} failed: {e}")
+            self._close()
+            return None
+
+    def get(self, uid):
+        data = self._safe_command("GET", self.prefix + uid)
+        if not data:
+            return None
+        token_info = _decode(data)
+        if token_info is None:
+            self.delete(uid)
+            return None
+        if token_info["expired_ts"] <= time():
+            return None
+        return token_info
+
+    def set(self, uid, token_info):
+        token_info = _cached_fields(token_info)
+        ttl_ms = int((token_info["expired_ts"] - time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        self._safe_command("SET", self.prefix + uid, json.dumps(token_info), "PX", ttl_ms)
+
+    def delete(self, uid):
+        self._safe_command("DEL", self.prefix + uid)
+
+    def clear(self):
+        """Delete every entry under our prefix (SCAN, so the server is not blocked)."""
+        cursor = b"0"
+        while True:
+            reply = self._safe_command("SCAN", cursor, "MATCH", self.prefix + "*", "COUNT", 500)
+            if reply is None:
+                return
+            cursor, keys = reply
+            if keys:
+                self._safe_command("DEL", *keys)
+            if cursor == b"0":
+                return
+
+
+def make_token_cache(url=None):
+    url = url or TOKEN_CACHE_URL
+    parts = urlsplit(url)
+    if parts.scheme == "memory":
+        return MemoryTokenCache()
+    if parts.scheme == "sqlite":
+        return SQLiteTokenCache(unquote(parts.path))
+    if parts.scheme == "redis":
+        db = parts.path.lstrip("/")
+        return RedisTokenCache(
+            host=parts.hostname or "localhost",
+            port=parts.port or 6379,
+            db=int(db) if db else 0,
+            password=unquote(parts.password) if parts.password else None,
+        )
+    raise ValueError(f"Unsupported TOKEN_CACHE_URL: {url}")